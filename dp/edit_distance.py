@@ -1,7 +1,12 @@
 from timeit import Timer
 from functools import partial
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import random
 import numpy as np
 
+from memo import DenseTable, Memoized
+
 def match(c1, c2):
     return 0 if c1 == c2 else 1
 
@@ -21,20 +26,22 @@ def edit_distance(x, i, y, j):
 
     return min(match_cost, insert_cost, delete_cost)
 
-def edit_distance_memoize(x, i, y, j, cache={}):
-    if (i, j) in cache: return cache[(i, j)]
-
+def _edit_distance_step(x, y, i, j):
+    # the `edit_distance` recurrence, yielding subproblems to `Memoized`
     if i == -1 and j == -1: return 0
-    if i == -1: return edit_distance_memoize(x, i, y, j-1) + delete(y[j])
-    if j == -1: return edit_distance_memoize(x, i-1, y, j) + insert(x[i])
-    match_cost = edit_distance_memoize(x, i-1, y, j-1) + match(x[i], y[j])
-    insert_cost = edit_distance_memoize(x, i-1, y, j) + insert(x[i])
-    delete_cost = edit_distance_memoize(x, i, y, j-1) + delete(y[j])
+    if i == -1: return (yield (i, j-1)) + delete(y[j])
+    if j == -1: return (yield (i-1, j)) + insert(x[i])
+    match_cost = (yield (i-1, j-1)) + match(x[i], y[j])
+    insert_cost = (yield (i-1, j)) + insert(x[i])
+    delete_cost = (yield (i, j-1)) + delete(y[j])
+
+    return min(match_cost, insert_cost, delete_cost)
 
-    value = min(match_cost, insert_cost, delete_cost)
-    cache[(i, j)] = value
-    # print i, j, cache[(i, j)]
-    return value
+def edit_distance_memoize(x, i, y, j, cache=None):
+    # each call gets its own table unless a cache is passed in
+    if cache is None:
+        cache = DenseTable((i+2, j+2), offset=1)
+    return Memoized(partial(_edit_distance_step, x, y), cache)(i, j)
 
 def edit_distance_table(x, y):
     cost = np.zeros((len(x)+1, len(y)+1), dtype=np.uint32)
@@ -52,8 +59,8 @@ def edit_distance_table(x, y):
     for i in range(1, len(x)+1):
         for j in range(1, len(y)+1):
             match_cost = cost[i-1, j-1] + match(x[i-1], y[j-1])
-            insert_cost = cost[i, j-1] + insert(y[i-1])
-            delete_cost = cost[i-1, j] + delete(x[j-1])
+            insert_cost = cost[i, j-1] + insert(y[j-1])
+            delete_cost = cost[i-1, j] + delete(x[i-1])
             cost[i, j] = min(match_cost, insert_cost, delete_cost)
 
     return cost[-1, -1]
@@ -78,30 +85,432 @@ def edit_distance_table_reconstruct(x, y):
     for i in range(1, len(x)+1):
         for j in range(1, len(y)+1):
             match_cost = cost[i-1, j-1] + match(x[i-1], y[j-1])
-            insert_cost = cost[i, j-1] + insert(y[i-1])
-            delete_cost = cost[i-1, j] + delete(x[j-1])
+            insert_cost = cost[i, j-1] + insert(y[j-1])
+            delete_cost = cost[i-1, j] + delete(x[i-1])
             choices = [match_cost, insert_cost, delete_cost]
             lowest = np.argmin(choices)
             cost[i, j] = choices[lowest]
             parent[i, j] = lowest
 
-    print parent
+    print(parent)
     return cost[-1, -1]
 
 
+def _as_codes(s):
+    # view a str, bytes-like or integer sequence as a 1-D integer array
+    if isinstance(s, str):
+        return np.frombuffer(s.encode('utf-32-le'), dtype=np.uint32)
+    if isinstance(s, (bytes, bytearray, memoryview)):
+        return np.frombuffer(s, dtype=np.uint8)
+    return np.asarray(s)
+
+def edit_distance_fast(x, y):
+    """
+    Unit-cost edit distance in O(min(m, n)) memory.
+
+    Only two rows of the table are kept, indexed by the shorter input, and
+    each row is computed with a handful of NumPy operations: the match and
+    delete candidates come from the previous row elementwise, and the
+    insertion chain along the row, cost[j] = min_k (cost[k] + j - k), is a
+    running minimum of cost[k] - k (`np.minimum.accumulate`).
+    """
+    x, y = _as_codes(x), _as_codes(y)
+    if len(x) < len(y):
+        # unit costs are symmetric, so the shorter input can index the rows
+        x, y = y, x
+    n = len(y)
+    if n == 0:
+        return len(x)
+
+    offsets = np.arange(n+1, dtype=np.int64)
+    prev = offsets.copy()
+    cur = np.empty(n+1, dtype=np.int64)
+    mismatch = np.empty(n, dtype=np.int64)
+    deletion = np.empty(n, dtype=np.int64)
+    for i, c in enumerate(x, 1):
+        np.not_equal(y, c, out=mismatch, casting='unsafe')
+        np.add(prev[:-1], mismatch, out=cur[1:])
+        np.add(prev[1:], 1, out=deletion)
+        np.minimum(cur[1:], deletion, out=cur[1:])
+        cur[0] = i
+
+        cur -= offsets
+        np.minimum.accumulate(cur, out=cur)
+        cur += offsets
+
+        prev, cur = cur, prev
+
+    return int(prev[-1])
+
+
+def myers_peq(x):
+    """
+    Match masks for Myers' algorithm: bit i of `peq[c]` is set when x[i] == c.
+    Python ints are arbitrary precision, so each mask is a multi-word bit
+    vector covering the whole pattern however long it is.
+    """
+    x = _as_codes(x)
+    peq = {}
+    for c in np.unique(x).tolist():
+        bits = np.packbits(x == c, bitorder='little')
+        peq[c] = int.from_bytes(bits.tobytes(), 'little')
+    return peq
+
+def myers_distance(peq, m, y, max_distance=None):
+    """
+    Unit-cost edit distance between the length-`m` pattern described by
+    `peq` and `y`, using Myers' bit-vector algorithm in Hyyrö's formulation.
+    Each column of the table is a pair of bit vectors of vertical +1/-1
+    deltas, updated with a constant number of word operations per word of
+    pattern (Python's big-int arithmetic carries between the words).
+
+    With `max_distance`, returns `max_distance + 1` as soon as the remaining
+    columns can no longer bring the distance within it.
+    """
+    if not isinstance(y, list):
+        y = _as_codes(y).tolist()
+    n = len(y)
+    if m == 0:
+        return n if max_distance is None else min(n, max_distance + 1)
+
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv = mask, 0
+    score = m
+    for j, c in enumerate(y):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+
+        # the top row of the table grows by one per column: shift in a +1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+
+        # each remaining column can lower the score by at most one
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return max_distance + 1
+
+    return score if max_distance is None else min(score, max_distance + 1)
+
+def edit_distance_bitparallel(x, y, max_distance=None):
+    """
+    Unit-cost edit distance in O(ceil(m/w) * n) word operations. The longer
+    input is used as the bit-vector pattern so that the Python-level loop
+    runs over the shorter one.
+    """
+    if len(x) < len(y):
+        x, y = y, x
+    return myers_distance(myers_peq(x), len(x), y, max_distance)
+
+def edit_distance_banded(x, y, max_distance):
+    """
+    Ukkonen's banded edit distance: only cells within `max_distance` of the
+    main diagonal can lie on a path of cost <= `max_distance`, so each row
+    evaluates that band (vectorized like `edit_distance_fast`) and the search
+    stops as soon as a whole band exceeds the threshold. Returns the distance,
+    or `max_distance + 1` if it is larger than `max_distance`.
+    """
+    x, y = _as_codes(x), _as_codes(y)
+    m, n, k = len(x), len(y), max_distance
+    if abs(m - n) > k:
+        return k + 1
+    if m == 0 or n == 0:
+        return max(m, n)
+
+    big = m + n + 1
+    prev = np.full(n+1, big, dtype=np.int64)
+    prev[:min(n, k)+1] = np.arange(min(n, k)+1)
+    cur = np.full(n+1, big, dtype=np.int64)
+    offsets = np.arange(2*k+2, dtype=np.int64)
+    work = np.empty(2*k+2, dtype=np.int64)
+    for i in range(1, m+1):
+        lo, hi = max(1, i-k), min(n, i+k)
+        width = hi - lo + 1
+        c = x[i-1]
+
+        # diagonal and vertical candidates inside the band
+        band = work[1:width+1]
+        np.add(prev[lo-1:hi], y[lo-1:hi] != c, out=band, casting='unsafe')
+        np.minimum(band, prev[lo:hi+1] + 1, out=band)
+
+        # horizontal chain, starting from column lo-1 (outside the band unless it is column 0)
+        work[0] = i if lo == 1 else big
+        chain = work[:width+1]
+        chain -= offsets[:width+1]
+        np.minimum.accumulate(chain, out=chain)
+        chain += offsets[:width+1]
+
+        cur[lo:hi+1] = band
+        cur[0] = i if i <= k else big
+        if band.min() > k:
+            return k + 1
+        prev, cur = cur, prev
+
+    return int(min(prev[n], k + 1))
+
+def edit_alignment(x, y, costs=None):
+    """
+    Optimal alignment of `x` and `y` by Hirschberg's divide and conquer: O(mn)
+    time but only O(m + n) memory.
+
+    `costs` is a `(match, insert, delete)` tuple of functions with the same
+    signatures as the module-level ones (`match(a, b)`, `insert(b)`,
+    `delete(a)`); by default those unit costs are used. Returns
+    `(ops, aligned_x, aligned_y)` where `ops` lists 'match', 'substitute',
+    'insert' (an item of `y` with a gap in `x`) and 'delete' (an item of `x`
+    with a gap in `y`). The aligned sequences are strings padded with '-' when
+    both inputs are strings, otherwise lists padded with None.
+    """
+    unit = costs is None
+    match_cost, insert_cost, delete_cost = (match, insert, delete) if unit else costs
+
+    xs, ys = list(x), list(y)
+    if unit:
+        xc, yc = _as_codes(x), _as_codes(y)
+    inserts = np.array([insert_cost(b) for b in ys], dtype=np.float64)
+    deletes = np.array([delete_cost(a) for a in xs], dtype=np.float64)
+
+    def last_row(i0, i1, j0, j1, backward):
+        # cost of aligning x[i0:i1] against every prefix of y[j0:j1] (suffixes,
+        # read backwards, when `backward`), computed a row at a time
+        js = np.arange(j0, j1)[::-1] if backward else np.arange(j0, j1)
+        chain = np.zeros(len(js)+1)
+        np.cumsum(inserts[js], out=chain[1:])
+        prev, cur = chain.copy(), np.empty(len(js)+1)
+        for i in (range(i1-1, i0-1, -1) if backward else range(i0, i1)):
+            if unit:
+                sub = yc[js] != xc[i]
+            else:
+                sub = np.array([match_cost(xs[i], ys[j]) for j in js.tolist()], dtype=np.float64)
+            np.minimum(prev[:-1] + sub, prev[1:] + deletes[i], out=cur[1:])
+            cur[0] = prev[0] + deletes[i]
+
+            # insertions along the row: cur[j] = min_k (cur[k] + inserts between k and j)
+            cur -= chain
+            np.minimum.accumulate(cur, out=cur)
+            cur += chain
+            prev, cur = cur, prev
+        return prev
+
+    def align_small(i0, i1, j0, j1):
+        # full table with traceback; only used when one side has a single item
+        rows, cols = i1 - i0 + 1, j1 - j0 + 1
+        cost = np.zeros((rows, cols))
+        cost[1:, 0] = np.cumsum(deletes[i0:i1])
+        cost[0, 1:] = np.cumsum(inserts[j0:j1])
+        for i in range(1, rows):
+            for j in range(1, cols):
+                cost[i, j] = min(cost[i-1, j-1] + match_cost(xs[i0+i-1], ys[j0+j-1]),
+                                 cost[i-1, j] + deletes[i0+i-1],
+                                 cost[i, j-1] + inserts[j0+j-1])
+
+        steps = []
+        i, j = rows - 1, cols - 1
+        while i > 0 or j > 0:
+            if i > 0 and j > 0 and cost[i, j] == cost[i-1, j-1] + match_cost(xs[i0+i-1], ys[j0+j-1]):
+                i, j = i-1, j-1
+                steps.append(('match' if xs[i0+i] == ys[j0+j] else 'substitute', i0+i, j0+j))
+            elif i > 0 and cost[i, j] == cost[i-1, j] + deletes[i0+i-1]:
+                i -= 1
+                steps.append(('delete', i0+i, None))
+            else:
+                j -= 1
+                steps.append(('insert', None, j0+j))
+        steps.reverse()
+        return steps
+
+    steps = []
+    stack = [(0, len(xs), 0, len(ys))]
+    while stack:
+        i0, i1, j0, j1 = stack.pop()
+        if i1 == i0:
+            steps.extend(('insert', None, j) for j in range(j0, j1))
+        elif j1 == j0:
+            steps.extend(('delete', i, None) for i in range(i0, i1))
+        elif i1 - i0 == 1 or j1 - j0 == 1:
+            steps.extend(align_small(i0, i1, j0, j1))
+        else:
+            # the optimal path crosses the middle row of x at the column that
+            # minimises forward cost + backward cost
+            mid = (i0 + i1) // 2
+            forward = last_row(i0, mid, j0, j1, False)
+            backward = last_row(mid, i1, j0, j1, True)
+            split = j0 + int(np.argmin(forward + backward[::-1]))
+            # the left half is popped (and emitted) first
+            stack.append((mid, i1, split, j1))
+            stack.append((i0, mid, j0, split))
+
+    ops = [op for op, i, j in steps]
+    aligned_x = [xs[i] if i is not None else None for op, i, j in steps]
+    aligned_y = [ys[j] if j is not None else None for op, i, j in steps]
+    if isinstance(x, str) and isinstance(y, str):
+        aligned_x = ''.join('-' if c is None else c for c in aligned_x)
+        aligned_y = ''.join('-' if c is None else c for c in aligned_y)
+    return ops, aligned_x, aligned_y
+
+def _prepare_query(query):
+    # per-query state shared by every comparison: match masks and histogram
+    codes = _as_codes(query)
+    return myers_peq(codes), len(codes), Counter(codes.tolist())
+
+def _query_distances(state, corpus, max_distance):
+    peq, m, histogram = state
+    result = np.empty(len(corpus), dtype=np.int64)
+    for index, s in enumerate(corpus):
+        codes = _as_codes(s).tolist()
+        if max_distance is not None:
+            # every item that is not shared by the two histograms costs at least one edit
+            n = len(codes)
+            if abs(m - n) > max_distance:
+                result[index] = max_distance + 1
+                continue
+            common = sum(min(count, histogram.get(c, 0)) for c, count in Counter(codes).items())
+            if max(m, n) - common > max_distance:
+                result[index] = max_distance + 1
+                continue
+        result[index] = myers_distance(peq, m, codes, max_distance)
+    return result
+
+# state installed in each pool process by its initializer
+_worker_state = None
+
+def _init_query_worker(query, max_distance):
+    global _worker_state
+    _worker_state = (_prepare_query(query), max_distance)
+
+def _query_chunk(corpus):
+    state, max_distance = _worker_state
+    return _query_distances(state, corpus, max_distance)
+
+def _init_matrix_worker(strings, max_distance):
+    global _worker_state
+    _worker_state = (strings, max_distance)
+
+def _matrix_rows(start, stop):
+    strings, max_distance = _worker_state
+    return [_query_distances(_prepare_query(strings[i]), strings[i+1:], max_distance)
+            for i in range(start, stop)]
+
+def edit_distance_many(query, corpus, max_distance=None, workers=1, chunk_size=1024):
+    """
+    Unit-cost edit distance from `query` to every item of `corpus`, as an
+    int64 array.
+
+    The query's bit-vector masks and character histogram are built once and
+    reused for every comparison. With `max_distance`, pairs whose length
+    difference or histogram difference already exceeds it are skipped, the
+    bit-parallel scan stops early, and such pairs are reported as
+    `max_distance + 1`. With `workers > 1` the corpus is split into
+    `chunk_size` pieces over a process pool, each process preparing the
+    query once.
+    """
+    if workers <= 1 or len(corpus) <= chunk_size:
+        return _query_distances(_prepare_query(query), corpus, max_distance)
+
+    chunks = [corpus[i:i+chunk_size] for i in range(0, len(corpus), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_query_worker,
+                             initargs=(query, max_distance)) as pool:
+        return np.concatenate(list(pool.map(_query_chunk, chunks)))
+
+def edit_distance_matrix(strings, max_distance=None, workers=1, rows_per_task=16):
+    """
+    Symmetric matrix of unit-cost edit distances between all pairs of
+    `strings`, with the same `max_distance` semantics as
+    `edit_distance_many`. Row i compares strings[i] with the strings after
+    it, and rows are fanned out over a process pool in `rows_per_task`
+    batches.
+    """
+    n = len(strings)
+    result = np.zeros((n, n), dtype=np.int64)
+    if workers <= 1:
+        rows = [_query_distances(_prepare_query(strings[i]), strings[i+1:], max_distance)
+                for i in range(n)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_matrix_worker,
+                                 initargs=(strings, max_distance)) as pool:
+            starts = range(0, n, rows_per_task)
+            batches = pool.map(_matrix_rows, starts, [min(i + rows_per_task, n) for i in starts])
+            rows = [row for batch in batches for row in batch]
+
+    for i, row in enumerate(rows):
+        result[i, i+1:] = row
+        result[i+1:, i] = row
+    return result
+
+def random_text(n, alphabet='acgt'):
+    return ''.join(random.choice(alphabet) for i in range(n))
+
+def check(trials=200):
+    # cross-check the fast versions against the recursive and memoized ones
+    for trial in range(trials):
+        x = random_text(random.randint(0, 6), 'ab')
+        y = random_text(random.randint(0, 6), 'ab')
+        expected = edit_distance(x, len(x)-1, y, len(y)-1)
+        assert expected == edit_distance_memoize(x, len(x)-1, y, len(y)-1)
+        assert expected == edit_distance_bitparallel(x, y)
+        for k in range(4):
+            assert min(expected, k+1) == edit_distance_banded(x, y, k)
+            assert min(expected, k+1) == edit_distance_bitparallel(x, y, k)
+
+    # long enough for multi-word bit vectors
+    for trial in range(20):
+        x = random_text(random.randint(0, 300))
+        y = random_text(random.randint(0, 300))
+        expected = edit_distance_fast(x, y)
+        assert expected == edit_distance_bitparallel(x, y)
+        k = random.randint(0, 300)
+        assert min(expected, k+1) == edit_distance_banded(x, y, k)
+
+        ops, aligned_x, aligned_y = edit_alignment(x, y)
+        assert aligned_x.replace('-', '') == x and aligned_y.replace('-', '') == y
+        assert sum(op != 'match' for op in ops) == expected
+
+    strings = [random_text(random.randint(0, 20), 'abc') for i in range(30)]
+    matrix = edit_distance_matrix(strings)
+    for k in [None, 0, 3]:
+        for i, query in enumerate(strings):
+            distances = edit_distance_many(query, strings, k)
+            expected = matrix[i] if k is None else np.minimum(matrix[i], k+1)
+            assert (distances == expected).all()
+
 def main():
+    check()
+
     s2 = "you should not"
     s1 = "thou shalt not"
 
-    # print edit_distance(s1, len(s1)-1, s2, len(s2)-1)
-    # print edit_distance_memoize(s1, len(s1)-1, s2, len(s2)-1)
-    # print edit_distance_table(s1, s2)
-    print edit_distance_table_reconstruct(s1, s2)
+    # print(edit_distance(s1, len(s1)-1, s2, len(s2)-1))
+    # print(edit_distance_memoize(s1, len(s1)-1, s2, len(s2)-1))
+    # print(edit_distance_table(s1, s2))
+    print(edit_distance_table_reconstruct(s1, s2))
+
+    # print(Timer(partial(edit_distance, s1, len(s1)-1, s2, len(s2)-1)).timeit(number=1))
+    # print(Timer(partial(edit_distance_memoize, s1, len(s1)-1, s2, len(s2)-1)).timeit(number=100))
+    # print(Timer(partial(edit_distance_table, s1, s2)).timeit(number=100))
+
+    for n in [100, 1000]:
+        x, y = random_text(n), random_text(n)
+        print(n, 'table', Timer(partial(edit_distance_table, x, y)).timeit(number=1))
+        print(n, 'fast', Timer(partial(edit_distance_fast, x, y)).timeit(number=1))
+        print(n, 'bit-parallel', Timer(partial(edit_distance_bitparallel, x, y)).timeit(number=1))
+        print(n, 'banded (k=10)', Timer(partial(edit_distance_banded, x, y, 10)).timeit(number=1))
 
-    # print Timer(partial(edit_distance, s1, len(s1)-1, s2, len(s2)-1)).timeit(number=1)
-    # print Timer(partial(edit_distance_memoize, s1, len(s1)-1, s2, len(s2)-1)).timeit(number=100)
-    # print Timer(partial(edit_distance_table, s1, s2)).timeit(number=100)
+    query = random_text(50)
+    corpus = [random_text(random.randint(40, 60)) for i in range(10**4)]
+    print('many', Timer(partial(edit_distance_many, query, corpus)).timeit(number=1))
+    print('many (k=5)', Timer(partial(edit_distance_many, query, corpus, 5)).timeit(number=1))
 
+    x, y = random_text(10**5), random_text(10**5)
+    print(10**5, 'fast', Timer(partial(edit_distance_fast, x, y)).timeit(number=1))
+    print(10**5, 'bit-parallel', Timer(partial(edit_distance_bitparallel, x, y)).timeit(number=1))
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,195 @@
+import numpy as np
+
 def knapsack(w, i, t):
-    if t < 0 or i < 0: return 0
+    if t < 0 or i == 0: return 0
     if w[i-1] > t: return knapsack(w, i-1, t)
     val = max(knapsack(w, i-1, t-w[i-1])+1, knapsack(w, i-1, t))
-    print t
     return val
 
+# above this many cells (items x capacities), reconstruction splits the items
+# in half instead of keeping a table of take/skip decisions
+DECISION_TABLE_LIMIT = 1 << 24
+
+def _as_values(values):
+    values = np.asarray(values)
+    return values.astype(np.int64 if values.dtype.kind in 'biu' else np.float64)
+
+def _check_weights(weights):
+    weights = np.asarray(weights, dtype=np.int64)
+    if (weights < 0).any():
+        raise ValueError("weights must be non-negative")
+    return weights
+
+def _add_item(best, w, v):
+    # best[c] = max(best[c], best[c-w] + v); the right-hand side is evaluated
+    # from the old row before anything is written, so each item is used once
+    if w == 0:
+        if v > 0:
+            best += v
+    elif w < len(best):
+        np.maximum(best[w:], best[:-w] + v, out=best[w:])
+
+def knapsack_values(weights, values, capacity):
+    """
+    Rolling 0/1 knapsack table: entry c is the best value of a subset of the
+    items with total weight at most c. One vectorized `np.maximum` per item.
+    """
+    best = np.zeros(capacity + 1, dtype=values.dtype)
+    for w, v in zip(weights.tolist(), values.tolist()):
+        _add_item(best, w, v)
+    return best
+
+def _choose_with_table(weights, values, items, capacity):
+    best = np.zeros(capacity + 1, dtype=values.dtype)
+    take = np.zeros((len(items), capacity + 1), dtype=bool)
+    for r, item in enumerate(items):
+        w, v = int(weights[item]), values[item]
+        if w == 0:
+            take[r] = v > 0
+            if v > 0:
+                best += v
+        elif w <= capacity:
+            candidate = best[:-w] + v
+            take[r, w:] = candidate > best[w:]
+            np.maximum(best[w:], candidate, out=best[w:])
+
+    chosen = []
+    c = capacity
+    for r in range(len(items) - 1, -1, -1):
+        if take[r, c]:
+            chosen.append(items[r])
+            c -= int(weights[items[r]])
+    return chosen
+
+def _choose(weights, values, capacity):
+    """
+    Items of an optimal 0/1 packing in O(capacity + items) extra memory:
+    split the items in half, compute the value row of each half, and give
+    each half the capacity that maximizes the sum of the two; recurse until
+    a piece is small enough to keep its decision table.
+    """
+    chosen = []
+    stack = [(np.arange(len(weights)), capacity)]
+    while stack:
+        items, capacity = stack.pop()
+        if len(items) == 0:
+            continue
+        if len(items) * (capacity + 1) <= DECISION_TABLE_LIMIT or len(items) == 1:
+            chosen.extend(_choose_with_table(weights, values, items, capacity))
+            continue
+
+        first, second = items[:len(items)//2], items[len(items)//2:]
+        left = knapsack_values(weights[first], values[first], capacity)
+        right = knapsack_values(weights[second], values[second], capacity)
+        split = int(np.argmax(left + right[::-1]))
+        stack.append((first, split))
+        stack.append((second, capacity - split))
+    return sorted(int(item) for item in chosen)
+
+def knapsack_01(weights, values, capacity):
+    """
+    0/1 knapsack with integer weights: returns `(best value, chosen item
+    indices)`. O(items x capacity) time, O(capacity) memory for the value and
+    linear extra memory to reconstruct the items.
+    """
+    weights, values = _check_weights(weights), _as_values(values)
+    best = knapsack_values(weights, values, capacity)
+    return best[capacity].item(), _choose(weights, values, capacity)
+
+def knapsack_bounded(weights, values, counts, capacity):
+    """
+    Knapsack where item i may be taken up to `counts[i]` times: returns
+    `(best value, number taken of each item)`. Each item is split into 0/1
+    pieces of 1, 2, 4, ... copies (binary splitting), so it costs
+    O(log count) vectorized passes rather than one per copy.
+    """
+    weights, values = _check_weights(weights), _as_values(values)
+    piece_weights, piece_values, owners, multiples = [], [], [], []
+    for item, (w, v, count) in enumerate(zip(weights.tolist(), values.tolist(), counts)):
+        if w > 0:
+            count = min(count, capacity // w)
+        size = 1
+        while count > 0:
+            size = min(size, count)
+            piece_weights.append(w * size)
+            piece_values.append(v * size)
+            owners.append(item)
+            multiples.append(size)
+            count -= size
+            size *= 2
+
+    taken = np.zeros(len(weights), dtype=np.int64)
+    if not piece_weights:
+        return values.dtype.type(0).item(), taken
+    value, pieces = knapsack_01(piece_weights, np.array(piece_values, dtype=values.dtype), capacity)
+    for piece in pieces:
+        taken[owners[piece]] += multiples[piece]
+    return value, taken
+
+def knapsack_unbounded(weights, values, capacity):
+    """
+    Knapsack with unlimited copies of every item: returns `(best value,
+    number taken of each item)`.
+    """
+    weights, values = _check_weights(weights), _as_values(values)
+    if ((weights == 0) & (values > 0)).any():
+        raise ValueError("a weightless item with positive value makes the value unbounded")
+    counts = [capacity // w if w > 0 else 0 for w in weights.tolist()]
+    return knapsack_bounded(weights, values, counts, capacity)
+
+def _subset_sums(weights, values):
+    # weight, value and bitmask of every subset, built by doubling
+    total_weight = np.zeros(1, dtype=weights.dtype)
+    total_value = np.zeros(1, dtype=values.dtype)
+    masks = np.zeros(1, dtype=np.int64)
+    for bit, (w, v) in enumerate(zip(weights, values)):
+        total_weight = np.concatenate([total_weight, total_weight + w])
+        total_value = np.concatenate([total_value, total_value + v])
+        masks = np.concatenate([masks, masks | (1 << bit)])
+    return total_weight, total_value, masks
+
+def knapsack_meet_in_the_middle(weights, values, capacity):
+    """
+    0/1 knapsack for few items (up to about 40) and any capacity, including
+    non-integer weights: O(2^(n/2) n) time and memory, independent of the
+    capacity. Returns `(best value, chosen item indices)`.
+
+    Enumerates the subsets of each half; the second half's subsets are sorted
+    by weight with a running maximum of value, so the best partner for each
+    subset of the first half is one binary search away.
+    """
+    weights, values = np.asarray(weights), _as_values(values)
+    if (weights < 0).any():
+        raise ValueError("weights must be non-negative")
+    half = len(weights) // 2
+
+    a_weight, a_value, a_mask = _subset_sums(weights[:half], values[:half])
+    b_weight, b_value, b_mask = _subset_sums(weights[half:], values[half:])
+
+    order = np.argsort(b_weight, kind='stable')
+    b_weight, b_value, b_mask = b_weight[order], b_value[order], b_mask[order]
+    running_best = np.maximum.accumulate(b_value)
+    positions = np.arange(len(b_value))
+    running_arg = np.maximum.accumulate(np.where(b_value == running_best, positions, 0))
+
+    fits = a_weight <= capacity
+    a_weight, a_value, a_mask = a_weight[fits], a_value[fits], a_mask[fits]
+    # the empty subset weighs nothing, so every partner index is >= 0
+    partner = np.searchsorted(b_weight, capacity - a_weight, side='right') - 1
+    totals = a_value + running_best[partner]
+    best = int(np.argmax(totals))
+
+    mask_a, mask_b = int(a_mask[best]), int(b_mask[running_arg[partner[best]]])
+    chosen = [i for i in range(half) if mask_a >> i & 1] + \
+             [half + i for i in range(len(weights) - half) if mask_b >> i & 1]
+    return totals[best].item(), chosen
+
 if __name__ == "__main__":
     weight = [10, 20, 30, 40]
-    print knapsack(weight, len(weight), 60)
+    print(knapsack(weight, len(weight), 60))
+
+    values = [60, 100, 120, 150]
+    print(knapsack_01(weight, values, 60))
+    print(knapsack_bounded(weight, values, [2, 1, 1, 3], 60))
+    print(knapsack_unbounded(weight, values, 60))
+    print(knapsack_meet_in_the_middle([10.5, 20.25, 30, 40], values, 60.75))
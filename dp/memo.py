@@ -0,0 +1,144 @@
+"""
+Memoization for top-down dynamic programming.
+
+A recurrence is written as a generator function: instead of calling itself,
+it yields the arguments of each subproblem it needs and receives the value
+back, then returns its own value. `Memoized` runs it on an explicit stack, so
+deep recurrences never hit Python's recursion limit, and stores results in a
+cache that belongs to that one problem instance:
+
+    def fib(n):
+        if n < 2: return n
+        return (yield (n-1,)) + (yield (n-2,))
+
+    Memoized(fib, DenseTable((91,)))(90)
+"""
+import numpy as np
+from collections import OrderedDict
+
+_MISSING = object()
+
+class DenseTable(object):
+    """
+    Array-backed cache for subproblems indexed by integer tuples in a known
+    range: `key[d] + offset[d]` must lie in `range(shape[d])`.
+    """
+    def __init__(self, shape, dtype=np.int64, offset=0):
+        self.values = np.zeros(shape, dtype=dtype)
+        self.filled = np.zeros(shape, dtype=bool)
+        self.offset = (offset,) * self.values.ndim if isinstance(offset, int) else tuple(offset)
+        self.hits = self.misses = 0
+
+    def _index(self, key):
+        index = tuple(k + o for k, o in zip(key, self.offset))
+        # NumPy rejects indices past the end, but would wrap negative ones around
+        if len(index) != self.values.ndim or min(index) < 0:
+            raise IndexError("key %r is outside the table" % (key,))
+        return index
+
+    def get(self, key, default=None):
+        index = self._index(key)
+        if self.filled[index]:
+            self.hits += 1
+            return self.values[index].item()
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        index = self._index(key)
+        self.values[index] = value
+        self.filled[index] = True
+
+    def __len__(self):
+        return int(self.filled.sum())
+
+    def clear(self):
+        self.filled[...] = False
+        self.hits = self.misses = 0
+
+class LRUCache(object):
+    """
+    Dict-backed cache for arbitrary hashable keys, holding at most `maxsize`
+    entries (unbounded when None) and evicting the least recently used.
+    """
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if self.maxsize is not None:
+            self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        if self.maxsize is not None:
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = 0
+
+class Memoized(object):
+    """
+    Evaluates the generator recurrence `step` with memoization in `cache`
+    (anything with `get(key, default)` and item assignment; a new unbounded
+    `LRUCache` by default). Keys are the argument tuples.
+    """
+    def __init__(self, step, cache=None):
+        self.step = step
+        self.cache = cache if cache is not None else LRUCache()
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def __call__(self, *args):
+        cache = self.cache
+        value = cache.get(args, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        stack = [(args, self.step(*args))]
+        value = None
+        while stack:
+            key, frame = stack[-1]
+            try:
+                needed = frame.send(value)
+            except StopIteration as done:
+                # the frame on top has finished: record it and resume its caller
+                stack.pop()
+                value = done.value
+                cache[key] = value
+                continue
+
+            value = cache.get(needed, _MISSING)
+            if value is _MISSING:
+                stack.append((needed, self.step(*needed)))
+                value = None
+        return value
+
+def memoize(step, shape=None, offset=0, maxsize=None, dtype=np.int64):
+    """
+    A `Memoized` recurrence with a fresh cache: a `DenseTable` when the index
+    space `shape` is known, otherwise an `LRUCache` bounded by `maxsize`.
+    """
+    if shape is not None:
+        return Memoized(step, DenseTable(shape, dtype=dtype, offset=offset))
+    return Memoized(step, LRUCache(maxsize))
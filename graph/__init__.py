@@ -0,0 +1,7 @@
+from .csr import CSRGraph
+from .shortest_paths import (SOURCE, UNREACHED, DijkstraSearch, NegativeCycleError, bellman_ford, dijkstra,
+                             johnson, reconstruct_path, shortest_path)
+from .traversal import articulation_vertices, find_cycle
+from .point_to_point import (AStarSearch, BidirectionalSearch, Landmarks, astar, bidirectional_dijkstra,
+                             euclidean_heuristic)
+from .contraction import ContractionHierarchy
@@ -0,0 +1,272 @@
+import heapq
+import os
+import numpy as np
+from timeit import Timer
+from .csr import CSRGraph, grid_graph, index_dtype
+from .shortest_paths import INF, UNREACHED, DijkstraSearch
+
+# files written by ContractionHierarchy.save
+ARRAYS = ('rank', 'up_indptr', 'up_indices', 'up_weights', 'up_middle',
+          'down_indptr', 'down_indices', 'down_weights', 'down_middle')
+
+def _witness_distances(out, source, skip, limit, settle_limit):
+    # local Dijkstra from `source` avoiding `skip`, abandoned beyond `limit`
+    dist = {source: 0.0}
+    Q = [(0.0, source)]
+    settled = 0
+    while Q and settled < settle_limit:
+        cost, node = heapq.heappop(Q)
+        if cost > dist[node]:
+            continue
+        if cost > limit:
+            break
+        settled += 1
+        for neighbor, weight in out[node].items():
+            candidate = cost + weight
+            if neighbor != skip and candidate < dist.get(neighbor, INF):
+                dist[neighbor] = candidate
+                heapq.heappush(Q, (candidate, neighbor))
+    return dist
+
+def _shortcuts(out, inc, vertex, settle_limit):
+    # (u, w, weight) for every path u -> vertex -> w with no shorter witness
+    shortcuts = []
+    for u, to_vertex in inc[vertex].items():
+        lengths = [(w, to_vertex + weight) for w, weight in out[vertex].items() if w != u]
+        if not lengths:
+            continue
+        dist = _witness_distances(out, u, vertex, max(l for w, l in lengths), settle_limit)
+        shortcuts.extend((u, w, l) for w, l in lengths if dist.get(w, INF) > l)
+    return shortcuts
+
+def _csr(edges):
+    # edges[v] is a list of (neighbor, weight, middle)
+    indptr = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in edges], out=indptr[1:])
+    flat = [edge for e in edges for edge in e]
+    indices = np.array([edge[0] for edge in flat], dtype=index_dtype(len(edges)))
+    weights = np.array([edge[1] for edge in flat], dtype=np.float64)
+    middle = np.array([edge[2] for edge in flat], dtype=np.int64)
+    return CSRGraph(indptr, indices, weights), middle
+
+class ContractionHierarchy(object):
+    """
+    Contraction hierarchy (Geisberger et al., 2008) for fast repeated
+    point-to-point queries on a static graph.
+
+    `build` contracts vertices one at a time in order of edge difference
+    (shortcuts added minus edges removed, plus the number of neighbours
+    already contracted, to spread contraction evenly), re-evaluating each
+    vertex's priority lazily when it reaches the front of the queue. A
+    shortcut u -> w replaces u -> v -> w unless a bounded witness search
+    finds a path no longer that avoids v.
+
+    The result is two CSR graphs, both leading from lower to higher rank:
+    `up` holds the edges out of each vertex to higher-ranked ones, and
+    `down` the edges into each vertex from higher-ranked ones, reversed. A
+    query is a bidirectional Dijkstra that only climbs: forward over `up`
+    from the source and backward over `down` from the target, usually
+    settling a few hundred vertices whatever the size of the graph.
+    `middle` gives each shortcut's contracted vertex (-1 for original
+    edges) for unpacking paths.
+
+    `save` writes the arrays with `numpy.save`; `load` maps them back with
+    `mmap_mode='r'`, and queries read them in place.
+    """
+    def __init__(self, rank, up, up_middle, down, down_middle):
+        super(ContractionHierarchy, self).__init__()
+        self.rank = rank
+        self.up, self.up_middle = up, up_middle
+        self.down, self.down_middle = down, down_middle
+        self.n_vertices = rank.shape[0]
+        self._dist = [[INF] * self.n_vertices, [INF] * self.n_vertices]
+        self._pred = [[UNREACHED] * self.n_vertices, [UNREACHED] * self.n_vertices]
+        self._touched = []
+        self.settled_ = 0
+
+    @classmethod
+    def build(cls, G, settle_limit=100):
+        n = G.n_vertices
+        out = [{} for _ in range(n)]
+        inc = [{} for _ in range(n)]
+        for u, w, weight in zip(*[a.tolist() for a in G.edges()]):
+            if u != w and weight < out[u].get(w, INF):
+                out[u][w] = inc[w][u] = weight
+        middle = {}
+        contracted_neighbors = [0] * n
+        rank = np.empty(n, dtype=np.int64)
+        up, down = [None] * n, [None] * n
+
+        def priority(vertex):
+            # also returns the shortcuts, which stay valid until a neighbour
+            # is contracted, so the final re-check's can be inserted as is
+            shortcuts = _shortcuts(out, inc, vertex, settle_limit)
+            edges = len(out[vertex]) + len(inc[vertex])
+            return len(shortcuts) - edges + contracted_neighbors[vertex], shortcuts
+
+        Q = [(priority(v)[0], v) for v in range(n)]
+        heapq.heapify(Q)
+        for order in range(n):
+            while True:
+                _, vertex = heapq.heappop(Q)
+                current, shortcuts = priority(vertex)
+                if not Q or current <= Q[0][0]:
+                    break
+                heapq.heappush(Q, (current, vertex))
+
+            for u, w, weight in shortcuts:
+                if weight < out[u].get(w, INF):
+                    out[u][w] = inc[w][u] = weight
+                    middle[u, w] = vertex
+            # the remaining neighbours all outrank `vertex`
+            for u in inc[vertex]:
+                del out[u][vertex]
+                contracted_neighbors[u] += 1
+            for w in out[vertex]:
+                del inc[w][vertex]
+                contracted_neighbors[w] += 1
+            up[vertex] = [(w, weight, middle.get((vertex, w), -1)) for w, weight in out[vertex].items()]
+            down[vertex] = [(u, weight, middle.get((u, vertex), -1)) for u, weight in inc[vertex].items()]
+            out[vertex] = inc[vertex] = None
+            rank[vertex] = order
+
+        up, up_middle = _csr(up)
+        down, down_middle = _csr(down)
+        return cls(rank, up, up_middle, down, down_middle)
+
+    def save(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        arrays = [self.rank, self.up.indptr, self.up.indices, self.up.weights, self.up_middle,
+                  self.down.indptr, self.down.indices, self.down.weights, self.down_middle]
+        for name, array in zip(ARRAYS, arrays):
+            np.save(os.path.join(directory, name + '.npy'), array)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAYS]
+        rank, up_indptr, up_indices, up_weights, up_middle = arrays[:5]
+        down_indptr, down_indices, down_weights, down_middle = arrays[5:]
+        return cls(rank, CSRGraph(up_indptr, up_indices, up_weights), up_middle,
+                   CSRGraph(down_indptr, down_indices, down_weights), down_middle)
+
+    def _reset(self):
+        for side, vertex in self._touched:
+            self._dist[side][vertex] = INF
+            self._pred[side][vertex] = UNREACHED
+        del self._touched[:]
+
+    def _middle(self, u, w):
+        # contracted vertex of the edge u -> w, stored on its lower-ranked end
+        if self.rank[u] < self.rank[w]:
+            graph, middle, tail, head = self.up, self.up_middle, u, w
+        else:
+            graph, middle, tail, head = self.down, self.down_middle, w, u
+        start = graph.indptr[tail]
+        return middle[start + graph.indices[start:graph.indptr[tail + 1]].tolist().index(head)]
+
+    def _unpack(self, hops):
+        path = [hops[0]]
+        stack = list(zip(hops[-2::-1], hops[:0:-1]))
+        while stack:
+            u, w = stack.pop()
+            m = self._middle(u, w)
+            if m < 0:
+                path.append(w)
+            else:
+                stack.append((m, w))
+                stack.append((u, m))
+        return path
+
+    def query(self, source, target, path=True):
+        """
+        Shortest `source` -> `target` distance and path (inf and [] if there
+        is none), or just the distance if `path` is False. `settled_` counts
+        the vertices the query settled.
+        """
+        self._reset()
+        graphs = [self.up, self.down]
+        queues = [[(0.0, source)], [(0.0, target)]]
+        for side, vertex in [(0, source), (1, target)]:
+            self._dist[side][vertex] = 0.0
+            self._touched.append((side, vertex))
+        best, meet = INF, UNREACHED
+
+        count = 0
+        side = 1
+        while queues[0] or queues[1]:
+            # a side stops once its queue cannot lead to anything shorter
+            for s in (0, 1):
+                if queues[s] and queues[s][0][0] >= best:
+                    del queues[s][:]
+            if not queues[1 - side] and not queues[side]:
+                break
+            if queues[1 - side]:
+                side = 1 - side
+            cost, node = heapq.heappop(queues[side])
+            dist, pred = self._dist[side], self._pred[side]
+            if cost > dist[node]:
+                continue
+            count += 1
+            if cost + self._dist[1 - side][node] < best:
+                best, meet = cost + self._dist[1 - side][node], node
+
+            # stall-on-demand: a higher-ranked vertex reaches `node` more
+            # cheaply, so this search's distance to it is not the shortest
+            # and relaxing its edges cannot help
+            H = graphs[1 - side]
+            start, end = H.indptr[node], H.indptr[node + 1]
+            if any(dist[u] + weight < cost
+                   for u, weight in zip(H.indices[start:end].tolist(), H.weights[start:end].tolist())):
+                continue
+
+            H = graphs[side]
+            start, end = H.indptr[node], H.indptr[node + 1]
+            for neighbor, weight in zip(H.indices[start:end].tolist(), H.weights[start:end].tolist()):
+                candidate = cost + weight
+                if candidate < dist[neighbor]:
+                    if dist[neighbor] == INF:
+                        self._touched.append((side, neighbor))
+                    dist[neighbor] = candidate
+                    pred[neighbor] = node
+                    heapq.heappush(queues[side], (candidate, neighbor))
+        self.settled_ = count
+
+        if not path:
+            return best
+        if meet == UNREACHED:
+            return INF, []
+        hops = [meet]
+        while self._pred[0][hops[-1]] >= 0:
+            hops.append(int(self._pred[0][hops[-1]]))
+        hops.reverse()
+        while self._pred[1][hops[-1]] >= 0:
+            hops.append(int(self._pred[1][hops[-1]]))
+        return best, self._unpack([int(v) for v in hops])
+
+def benchmark(side=60, queries=500):
+    rng = np.random.default_rng(0)
+    G = grid_graph(side, rng)
+    pairs = rng.integers(G.n_vertices, size=(queries, 2)).tolist()
+
+    hierarchy = []
+    elapsed = Timer(lambda: hierarchy.append(ContractionHierarchy.build(G))).timeit(number=1)
+    hierarchy = hierarchy[0]
+    print('build: %.2fs, %d shortcuts' % (elapsed, np.sum(hierarchy.up_middle >= 0) +
+                                          np.sum(hierarchy.down_middle >= 0)))
+
+    search = DijkstraSearch(G)
+    engines = [('dijkstra', search.query), ('hierarchy', hierarchy.query),
+               ('no path', lambda s, t: hierarchy.query(s, t, path=False))]
+    for name, query in engines:
+        settled = []
+        engine = search if name == 'dijkstra' else hierarchy
+        def run():
+            for s, t in pairs:
+                query(s, t)
+                settled.append(engine.settled_)
+        elapsed = Timer(run).timeit(number=1)
+        print('%-10s%10.3f ms/query%10.0f settled/query' % (name, 1000 * elapsed / queries, np.mean(settled)))
+
+if __name__ == "__main__":
+    benchmark()
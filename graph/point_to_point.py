@@ -0,0 +1,286 @@
+import heapq
+import math
+import numpy as np
+from timeit import Timer
+from .csr import grid_graph
+from .shortest_paths import INF, SOURCE, UNREACHED, DijkstraSearch, _adjacency, dijkstra, reconstruct_path
+
+def _buffers(n, as_lists):
+    # distance, predecessor and settled flags for one search direction
+    if as_lists:
+        return [INF] * n, [UNREACHED] * n, bytearray(n)
+    return np.full(n, INF), np.full(n, UNREACHED, dtype=np.int64), bytearray(n)
+
+class BidirectionalSearch(object):
+    """
+    Repeated bidirectional Dijkstra queries on one graph, searching forward
+    from the source over `G` and backward from the target over its reverse
+    (computed if not given).
+
+    Each step advances the side whose queue has the smaller minimum, and the
+    search stops once those two minimums add up to at least the best
+    source -> target distance seen through any vertex reached from both
+    sides. As in `DijkstraSearch`, the buffers are allocated once and each
+    query resets only the entries the previous one touched; `as_lists`
+    has the same meaning. `settled_` counts the vertices the last query
+    settled on both sides together.
+    """
+    def __init__(self, G, reverse=None, as_lists=None):
+        super(BidirectionalSearch, self).__init__()
+        reverse = G.reverse() if reverse is None else reverse
+        self._graphs = [_adjacency(G, as_lists), _adjacency(reverse, as_lists)]
+        lists = isinstance(self._graphs[0][0], list)
+        self._state = [_buffers(G.n_vertices, lists), _buffers(G.n_vertices, lists)]
+        self._touched = [[], []]
+        self.settled_ = 0
+
+    def _reset(self):
+        for (dist, pred, settled), touched in zip(self._state, self._touched):
+            for vertex in touched:
+                dist[vertex] = INF
+                pred[vertex] = UNREACHED
+                settled[vertex] = 0
+            del touched[:]
+
+    def query(self, source, target):
+        """Shortest distance and path from `source` to `target` (inf and [] if none)."""
+        self._reset()
+        for side, vertex in [(0, source), (1, target)]:
+            dist, pred, _ = self._state[side]
+            dist[vertex] = 0.0
+            pred[vertex] = SOURCE
+            self._touched[side].append(vertex)
+        queues = [[(0.0, source)], [(0.0, target)]]
+        best, meet = (0.0, source) if source == target else (INF, UNREACHED)
+
+        count = 0
+        while queues[0] and queues[1] and queues[0][0][0] + queues[1][0][0] < best:
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            cost, node = heapq.heappop(queues[side])
+            dist, pred, settled = self._state[side]
+            if settled[node]:
+                continue
+            settled[node] = 1
+            count += 1
+
+            other = self._state[1 - side][0]
+            touched = self._touched[side]
+            indptr, indices, weights = self._graphs[side]
+            for e in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[e]
+                candidate = cost + weights[e]
+                if candidate < dist[neighbor]:
+                    if dist[neighbor] == INF:
+                        touched.append(neighbor)
+                    dist[neighbor] = candidate
+                    pred[neighbor] = node
+                    heapq.heappush(queues[side], (candidate, neighbor))
+                    if candidate + other[neighbor] < best:
+                        best, meet = candidate + other[neighbor], neighbor
+        self.settled_ = count
+
+        if meet == UNREACHED:
+            return INF, []
+        path = reconstruct_path(self._state[0][1], meet)
+        backward = self._state[1][1]
+        while backward[path[-1]] >= 0:
+            path.append(int(backward[path[-1]]))
+        return float(best), path
+
+class AStarSearch(object):
+    """
+    Repeated A* queries on one graph, with buffers reused across queries as
+    in `DijkstraSearch` (and the same `as_lists`).
+
+    The heuristic is a per-vertex lower bound on the remaining distance to
+    the target, given as a function of the vertex (see
+    `euclidean_heuristic` and `Landmarks.heuristic`) or an array, and is
+    evaluated only at the vertices the search reaches. Vertices are settled
+    once, so it must be consistent (h(u) <= w(u, v) + h(v)), as the
+    Euclidean and landmark bounds are. `settled_` counts the vertices the
+    last query settled.
+    """
+    def __init__(self, G, as_lists=None):
+        super(AStarSearch, self).__init__()
+        self._indptr, self._indices, self._weights = _adjacency(G, as_lists)
+        self._dist, self._pred, self._settled = _buffers(G.n_vertices, isinstance(self._indptr, list))
+        self._touched = []
+        self.settled_ = 0
+
+    def _reset(self):
+        dist, pred, settled = self._dist, self._pred, self._settled
+        for vertex in self._touched:
+            dist[vertex] = INF
+            pred[vertex] = UNREACHED
+            settled[vertex] = 0
+        del self._touched[:]
+
+    def query(self, source, target, heuristic):
+        """Shortest distance and path from `source` to `target` (inf and [] if none)."""
+        self._reset()
+        h = heuristic if callable(heuristic) else heuristic.__getitem__
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        dist, pred, settled, touched = self._dist, self._pred, self._settled, self._touched
+        dist[source] = 0.0
+        pred[source] = SOURCE
+        touched.append(source)
+
+        Q = [(h(source), source)]
+        count = 0
+        while Q:
+            estimate, node = heapq.heappop(Q)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            count += 1
+            if node == target:
+                break
+            cost = dist[node]
+            for e in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[e]
+                candidate = cost + weights[e]
+                if candidate < dist[neighbor]:
+                    if dist[neighbor] == INF:
+                        touched.append(neighbor)
+                    dist[neighbor] = candidate
+                    pred[neighbor] = node
+                    heapq.heappush(Q, (candidate + h(neighbor), neighbor))
+        self.settled_ = count
+        return float(dist[target]), reconstruct_path(pred, target)
+
+def bidirectional_dijkstra(G, source, target, reverse=None):
+    """
+    Shortest `source` -> `target` distance and path with a one-off
+    `BidirectionalSearch` (pass `G.reverse()` as `reverse`, or keep a
+    `BidirectionalSearch`, when running many queries). Returns (distance,
+    path, settled).
+    """
+    search = BidirectionalSearch(G, reverse, as_lists=False)
+    distance, path = search.query(source, target)
+    return distance, path, search.settled_
+
+def astar(G, source, target, heuristic):
+    """
+    Shortest `source` -> `target` distance and path with a one-off
+    `AStarSearch` guided by `heuristic`. Returns (distance, path, settled).
+    """
+    search = AStarSearch(G, as_lists=False)
+    distance, path = search.query(source, target, heuristic)
+    return distance, path, search.settled_
+
+def euclidean_heuristic(coords, target, scale=1.0):
+    """
+    Straight-line distance to `target` for vertices at `coords`, an
+    n_vertices x d array (read in place if it is float64), times `scale`,
+    which must not exceed the smallest ratio of edge weight to edge length
+    (1 when weights are at least the lengths). Returns a function of the
+    vertex, for `astar`.
+    """
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    d = coords.shape[1]
+    flat = memoryview(coords.reshape(-1))
+    goal = flat[target * d:(target + 1) * d].tolist()
+
+    def heuristic(vertex):
+        return scale * math.dist(flat[vertex * d:(vertex + 1) * d], goal)
+    return heuristic
+
+class Landmarks(object):
+    """
+    ALT preprocessing: exact distance tables from and to a few landmark
+    vertices, whose triangle inequalities bound the distance between any
+    two vertices: d(v, t) >= d(v, L) - d(t, L) and d(v, t) >= d(L, t) - d(L, v).
+
+    Landmarks are picked greedily, each the vertex farthest from those
+    already chosen, which places them on the fringe of the graph where the
+    bounds are tightest. `dist_from[i]` and `dist_to[i]` are the tables
+    for landmark `landmarks[i]`.
+    """
+    def __init__(self, G, n_landmarks=8, reverse=None, random_state=None):
+        super(Landmarks, self).__init__()
+        reverse = G.reverse() if reverse is None else reverse
+        rng = np.random.default_rng(random_state)
+        self.landmarks = []
+        self.dist_from = np.empty((n_landmarks, G.n_vertices))
+        self.dist_to = np.empty((n_landmarks, G.n_vertices))
+
+        nearest = np.full(G.n_vertices, INF)
+        vertex = int(rng.integers(G.n_vertices))
+        for i in range(n_landmarks):
+            self.landmarks.append(vertex)
+            self.dist_from[i] = dijkstra(G, vertex)[0]
+            self.dist_to[i] = dijkstra(reverse, vertex)[0]
+            nearest = np.minimum(nearest, self.dist_from[i])
+            # ignore vertices the landmarks cannot reach
+            vertex = int(np.argmax(np.where(np.isfinite(nearest), nearest, -1)))
+
+    def heuristic(self, target):
+        """
+        Lower bound on the distance from a vertex to `target`, as a function
+        of the vertex for `astar`. It reads the tables in place, so building
+        it costs nothing per vertex.
+        """
+        tables = [(memoryview(to), float(to[target]), memoryview(frm), float(frm[target]))
+                  for to, frm in zip(self.dist_to, self.dist_from)]
+
+        def heuristic(vertex):
+            bound = 0.0
+            for to, to_target, frm, from_target in tables:
+                # inf - inf is nan, which max() skips while `bound` comes
+                # first: a landmark that neither vertex reaches tells nothing
+                bound = max(bound, to[vertex] - to_target, from_target - frm[vertex])
+            return bound
+        return heuristic
+
+    def save(self, path):
+        np.savez(path, landmarks=self.landmarks, dist_from=self.dist_from, dist_to=self.dist_to)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        landmarks = cls.__new__(cls)
+        landmarks.landmarks = data['landmarks'].tolist()
+        landmarks.dist_from = data['dist_from']
+        landmarks.dist_to = data['dist_to']
+        return landmarks
+
+def benchmark(side=1000, queries=200, radius=20, n_landmarks=4):
+    # local queries (target within `radius` rows and columns of the source)
+    # on a large grid with weights between 1 and 2 times the edge length,
+    # where a query's cost should not depend on the size of the graph
+    rng = np.random.default_rng(0)
+    G = grid_graph(side, rng)
+    coords = np.stack(np.divmod(np.arange(G.n_vertices), side), 1).astype(np.float64)
+    reverse = G.reverse()
+    sources = rng.integers(G.n_vertices, size=queries)
+    offsets = rng.integers(-radius, radius + 1, size=(queries, 2))
+    rows = np.clip(sources // side + offsets[:, 0], 0, side - 1)
+    cols = np.clip(sources % side + offsets[:, 1], 0, side - 1)
+    pairs = list(zip(sources.tolist(), (rows * side + cols).tolist()))
+
+    landmarks = []
+    elapsed = Timer(lambda: landmarks.append(Landmarks(G, n_landmarks, reverse, random_state=0))).timeit(number=1)
+    landmarks = landmarks[0]
+    print('%d vertices, %d landmarks in %.1fs' % (G.n_vertices, n_landmarks, elapsed))
+
+    dijkstra_search = DijkstraSearch(G)
+    bidirectional = BidirectionalSearch(G, reverse)
+    search = AStarSearch(G)
+    engines = [
+        ('dijkstra', dijkstra_search, dijkstra_search.query),
+        ('bidirectional', bidirectional, bidirectional.query),
+        ('A* euclidean', search, lambda s, t: search.query(s, t, euclidean_heuristic(coords, t))),
+        ('A* landmarks', search, lambda s, t: search.query(s, t, landmarks.heuristic(t))),
+    ]
+    print('%-16s%12s%16s' % ('method', 'ms/query', 'settled/query'))
+    for name, engine, query in engines:
+        settled = []
+        def run():
+            for s, t in pairs:
+                query(s, t)
+                settled.append(engine.settled_)
+        elapsed = Timer(run).timeit(number=1)
+        print('%-16s%12.3f%16.0f' % (name, 1000 * elapsed / queries, np.mean(settled)))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,341 @@
+import heapq
+import numpy as np
+from collections import deque
+from timeit import Timer
+from .csr import CSRGraph, grid_graph
+
+# predecessor markers for vertices without a predecessor
+UNREACHED, SOURCE = -1, -2
+INF = float('inf')
+
+def reconstruct_path(pred, target):
+    """Vertices from the search's source to `target`, or [] if unreachable."""
+    if pred[target] == UNREACHED:
+        return []
+    path = [target]
+    while pred[path[-1]] >= 0:
+        path.append(int(pred[path[-1]]))
+    path.reverse()
+    return path
+
+# Python lists index about twice as fast as NumPy arrays in the search loops
+# but cost some 60-70 bytes per edge against the CSR's 12, so larger graphs
+# are searched over their arrays directly
+LIST_ADJACENCY_LIMIT = 1 << 22
+
+def _adjacency(G, as_lists=None):
+    if as_lists is None:
+        as_lists = G.n_edges <= LIST_ADJACENCY_LIMIT
+    if as_lists:
+        return G.indptr.tolist(), G.indices.tolist(), G.weights.tolist()
+    return G.indptr, G.indices, G.weights
+
+def _as_vertices(vertices):
+    return [int(v) for v in np.atleast_1d(vertices)]
+
+def _search(indptr, indices, weights, dist, pred, settled, sources, targets, touched):
+    """
+    Dijkstra's main loop over any indexable adjacency and state (NumPy arrays
+    or plain lists). Heap entries are never updated in place: a vertex is
+    pushed again whenever its distance drops and stale entries are skipped
+    when popped. Stops once every vertex in `targets` is settled. Records
+    every vertex given a distance in `touched` and returns the number of
+    vertices settled.
+    """
+    heappush, heappop = heapq.heappush, heapq.heappop
+    Q = []
+    for source in sources:
+        if dist[source] != 0:
+            touched.append(source)
+            dist[source] = 0.0
+            pred[source] = SOURCE
+            Q.append((0.0, source))
+    heapq.heapify(Q)
+    pending = set(targets) if targets is not None else None
+
+    count = 0
+    while Q:
+        cost, node = heappop(Q)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        count += 1
+        if pending is not None:
+            pending.discard(node)
+            if not pending:
+                break
+        for e in range(indptr[node], indptr[node + 1]):
+            neighbor = indices[e]
+            candidate = cost + weights[e]
+            if candidate < dist[neighbor]:
+                if dist[neighbor] == INF:
+                    touched.append(neighbor)
+                dist[neighbor] = candidate
+                pred[neighbor] = node
+                heappush(Q, (candidate, neighbor))
+    return count
+
+def dijkstra(G, sources, targets=None):
+    """
+    Shortest paths over non-negative weights from the nearest of `sources`
+    (a vertex or a sequence of them). Returns the distance array (inf where
+    unreachable) and the predecessor array (UNREACHED where unreachable,
+    SOURCE at the sources).
+
+    With `targets` the search stops as soon as they are all settled; other
+    vertices then hold upper bounds, or inf if never reached.
+    """
+    dist = np.full(G.n_vertices, INF)
+    pred = np.full(G.n_vertices, UNREACHED, dtype=np.int64)
+    settled = np.zeros(G.n_vertices, dtype=np.uint8)
+    targets = None if targets is None else _as_vertices(targets)
+    _search(G.indptr, G.indices, G.weights, dist, pred, settled, _as_vertices(sources), targets, [])
+    return dist, pred
+
+class DijkstraSearch(object):
+    """
+    Repeated Dijkstra queries on one graph, for serving many queries.
+
+    The distance, predecessor and settled buffers are allocated once. With
+    `as_lists` (by default, for graphs of up to LIST_ADJACENCY_LIMIT edges)
+    the adjacency and buffers are copied into Python lists, which the inner
+    loop indexes about twice as fast but which take several times the
+    memory of the CSR arrays. Each run resets only
+    the entries the previous run touched, so an early-exit point-to-point
+    query costs time proportional to the part of the graph it explores,
+    not to the graph's size. `settled_` is the number of vertices the last
+    run settled.
+    """
+    def __init__(self, G, as_lists=None):
+        super(DijkstraSearch, self).__init__()
+        self.G = G
+        self._indptr, self._indices, self._weights = _adjacency(G, as_lists)
+        if isinstance(self._indptr, list):
+            self._dist = [INF] * G.n_vertices
+            self._pred = [UNREACHED] * G.n_vertices
+        else:
+            self._dist = np.full(G.n_vertices, INF)
+            self._pred = np.full(G.n_vertices, UNREACHED, dtype=np.int64)
+        self._settled = bytearray(G.n_vertices)
+        self._touched = []
+        self.settled_ = 0
+
+    def _reset(self):
+        dist, pred, settled = self._dist, self._pred, self._settled
+        for vertex in self._touched:
+            dist[vertex] = INF
+            pred[vertex] = UNREACHED
+            settled[vertex] = 0
+        del self._touched[:]
+
+    def run(self, sources, targets=None):
+        """Search from `sources`, stopping once all `targets` are settled."""
+        self._reset()
+        targets = None if targets is None else _as_vertices(targets)
+        self.settled_ = _search(self._indptr, self._indices, self._weights, self._dist, self._pred,
+                                self._settled, _as_vertices(sources), targets, self._touched)
+        return self
+
+    def distance(self, target):
+        return float(self._dist[target])
+
+    def path(self, target):
+        return reconstruct_path(self._pred, target)
+
+    def distances(self, targets):
+        return np.array([self._dist[t] for t in _as_vertices(targets)])
+
+    def query(self, source, target):
+        """Shortest distance and path from `source` to `target`."""
+        self.run(source, target)
+        return self.distance(target), self.path(target)
+
+    def distance_table(self, sources, targets):
+        """
+        Distances from every source to every target, one early-exit search
+        per source.
+        """
+        sources, targets = _as_vertices(sources), _as_vertices(targets)
+        table = np.empty((len(sources), len(targets)))
+        for row, source in enumerate(sources):
+            table[row] = self.run(source, targets).distances(targets)
+        return table
+
+def shortest_path(G, source, target):
+    dist, pred = dijkstra(G, source, target)
+    return reconstruct_path(pred, target)
+
+class NegativeCycleError(ValueError):
+    """A negative cycle is reachable; `cycle` lists its vertices in edge order."""
+    def __init__(self, cycle):
+        super(NegativeCycleError, self).__init__("negative cycle through vertices %s" % (cycle,))
+        self.cycle = cycle
+
+def _pred_cycle(pred, starts):
+    """
+    A cycle in the predecessor graph reachable backwards from `starts`, in
+    edge order, or None. Every vertex has at most one predecessor, so each
+    walk either ends at a root, joins an earlier walk or closes a cycle.
+    """
+    walk = np.full(pred.shape[0], -1, dtype=np.int64)
+    for i, vertex in enumerate(starts):
+        while vertex >= 0 and walk[vertex] < 0:
+            walk[vertex] = i
+            vertex = pred[vertex]
+        if vertex >= 0 and walk[vertex] == i:
+            cycle = [int(vertex)]
+            while pred[cycle[-1]] != vertex:
+                cycle.append(int(pred[cycle[-1]]))
+            cycle.reverse()
+            return cycle
+    return None
+
+def _bellman_ford_vectorized(G, dist, pred):
+    # every pass relaxes all edges out of vertices that changed in the last one
+    sources, targets, weights = G.edges()
+    changed = np.isfinite(dist)
+    passes = 0
+    while changed.any():
+        live = changed[sources]
+        u, v = sources[live], targets[live]
+        candidate = dist[u] + weights[live]
+        better = candidate < dist[v]
+        u, v, candidate = u[better], v[better], candidate[better]
+        if not v.size:
+            break
+
+        updated = dist.copy()
+        np.minimum.at(updated, v, candidate)
+        winner = candidate == updated[v]
+        pred[v[winner]] = u[winner]
+        changed = updated < dist
+        dist[:] = updated
+
+        # past |V|-1 passes only a negative cycle can still change anything;
+        # it eventually shows up as a cycle of predecessors
+        passes += 1
+        if passes >= G.n_vertices:
+            cycle = _pred_cycle(pred, np.flatnonzero(changed))
+            if cycle is not None:
+                raise NegativeCycleError(cycle)
+
+def _bellman_ford_spfa(G, dist, pred):
+    # queue of vertices whose distance dropped since their edges were last relaxed
+    indptr, indices, weights = _adjacency(G)
+    n = G.n_vertices
+    queue = deque(np.flatnonzero(np.isfinite(dist)).tolist())
+    queued = bytearray(n)
+    hops = np.zeros(n, dtype=np.int64)
+    for vertex in queue:
+        queued[vertex] = 1
+
+    while queue:
+        node = queue.popleft()
+        queued[node] = 0
+        cost = dist[node]
+        for e in range(indptr[node], indptr[node + 1]):
+            neighbor = indices[e]
+            candidate = cost + weights[e]
+            if candidate < dist[neighbor]:
+                dist[neighbor] = candidate
+                pred[neighbor] = node
+                # a shortest path has at most |V|-1 edges
+                hops[neighbor] = hops[node] + 1
+                if hops[neighbor] >= n:
+                    cycle = _pred_cycle(pred, [neighbor])
+                    if cycle is not None:
+                        raise NegativeCycleError(cycle)
+                if not queued[neighbor]:
+                    queued[neighbor] = 1
+                    queue.append(neighbor)
+
+def bellman_ford(G, sources, method='vectorized'):
+    """
+    Shortest paths from the nearest of `sources` allowing negative weights.
+    Returns the distance and predecessor arrays like `dijkstra`, or raises
+    NegativeCycleError naming the vertices of a reachable negative cycle.
+
+    'vectorized' relaxes the edges out of every vertex that changed in the
+    previous pass at once with NumPy (`np.minimum.at` keeps the smallest
+    candidate per vertex). 'spfa' keeps a FIFO queue of changed vertices
+    and relaxes one vertex's edges at a time, over a list copy of the
+    adjacency only up to LIST_ADJACENCY_LIMIT edges. Both stop as soon as nothing
+    changes, which often takes far fewer than |V|-1 passes.
+    """
+    if method not in BELLMAN_FORD_METHODS:
+        raise ValueError("unknown method %r" % (method,))
+    dist = np.full(G.n_vertices, INF)
+    pred = np.full(G.n_vertices, UNREACHED, dtype=np.int64)
+    sources = _as_vertices(sources)
+    dist[sources] = 0
+    pred[sources] = SOURCE
+    BELLMAN_FORD_METHODS[method](G, dist, pred)
+    return dist, pred
+
+BELLMAN_FORD_METHODS = {'vectorized': _bellman_ford_vectorized, 'spfa': _bellman_ford_spfa}
+
+def johnson(G, sources=None, method='vectorized'):
+    """
+    All-pairs shortest distances with negative weights (Johnson, 1977):
+    one Bellman-Ford from a virtual source joined to every vertex gives
+    potentials h with w(u, v) + h(u) - h(v) >= 0, then every row is a
+    Dijkstra over the reweighted graph. Returns the distances from each of
+    `sources` (all vertices if None) to every vertex, one row per source.
+    """
+    # starting every vertex at 0 is the virtual source's first pass
+    h = bellman_ford(G, np.arange(G.n_vertices), method)[0]
+    sources_, targets, weights = G.edges()
+    # rounding can leave reweighted edges just below zero
+    reweighted = np.maximum(weights + h[sources_] - h[targets], 0)
+    search = DijkstraSearch(CSRGraph(G.indptr, G.indices, reweighted))
+
+    sources = np.arange(G.n_vertices) if sources is None else np.atleast_1d(sources)
+    everything = np.arange(G.n_vertices)
+    table = np.empty((sources.shape[0], G.n_vertices))
+    for row, source in enumerate(sources):
+        table[row] = search.run(source).distances(everything) - h[source] + h
+    return table
+
+def main():
+    G = CSRGraph.from_adjacency({0: [(1, 2), (2, 1)], 1: [(3, 2)], 2: [(3, 1)], 3: []})
+    print(shortest_path(G, 0, 3))
+
+    G = CSRGraph.from_adjacency({0: [(1, 8), (2, 10)], 1: [(3, 1)], 2: [(5, 2)], 3: [(2, -4), (5, -1)],
+                                 4: [(2, 1)], 5: [(4, -2)]})
+    print(bellman_ford(G, 0))
+    print(johnson(G))
+
+    G = CSRGraph.from_adjacency({0: [(1, 1)], 1: [(2, -2)], 2: [(1, 1), (3, 1)], 3: []})
+    try:
+        bellman_ford(G, 0, 'spfa')
+    except NegativeCycleError as e:
+        print(e.cycle)
+
+def benchmark(side=100, queries=500):
+    # random queries on a grid with random weights
+    rng = np.random.default_rng(0)
+    G = grid_graph(side, rng, 0.1, 1.1)
+    pairs = rng.integers(G.n_vertices, size=(queries, 2))
+
+    elapsed = Timer(lambda: dijkstra(G, 0)).timeit(number=1)
+    print('one-to-all dijkstra: %.3fs' % elapsed)
+    search = DijkstraSearch(G)
+    elapsed = Timer(lambda: [search.query(s, t) for s, t in pairs]).timeit(number=1)
+    print('point-to-point: %d queries/s' % (queries / elapsed))
+
+def benchmark_bellman_ford(side=300):
+    # negative weights without negative cycles: shift positive ones by random potentials
+    rng = np.random.default_rng(0)
+    G = grid_graph(side, rng, 0.1, 1.1)
+    potential = rng.random(G.n_vertices)
+    sources, targets, weights = G.edges()
+    G = CSRGraph(G.indptr, G.indices, weights + potential[sources] - potential[targets])
+    print('%d vertices, %d negative edges' % (G.n_vertices, np.sum(G.weights < 0)))
+    for method in BELLMAN_FORD_METHODS:
+        elapsed = Timer(lambda: bellman_ford(G, 0, method)).timeit(number=1)
+        print('%-12s%8.3fs' % (method, elapsed))
+
+if __name__ == "__main__":
+    main()
+    benchmark()
+    benchmark_bellman_ford()
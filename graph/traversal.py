@@ -0,0 +1,109 @@
+import numpy as np
+from .csr import CSRGraph
+
+# depth-first search states
+NEW, ACTIVE, PROCESSED = 0, 1, 2
+
+def find_cycle(G, source=None):
+    """
+    Directed cycle reachable from `source` (from any vertex if None), as the
+    list of its vertices in edge order, or None if there is none. A cycle
+    shows up as a back edge: one to a vertex still on the search stack.
+    """
+    indptr, indices = G.indptr, G.indices
+    state = np.zeros(G.n_vertices, dtype=np.int8)
+    parent = np.full(G.n_vertices, -1, dtype=np.int64)
+    next_edge = indptr[:-1].copy()
+
+    roots = range(G.n_vertices) if source is None else [source]
+    for root in roots:
+        if state[root] != NEW:
+            continue
+        state[root] = ACTIVE
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            e = next_edge[node]
+            if e == indptr[node + 1]:
+                state[node] = PROCESSED
+                stack.pop()
+                continue
+            next_edge[node] = e + 1
+            neighbor = indices[e]
+            if state[neighbor] == NEW:
+                state[neighbor] = ACTIVE
+                parent[neighbor] = node
+                stack.append(neighbor)
+            elif state[neighbor] == ACTIVE:
+                # back edge node -> neighbor closes the cycle
+                cycle = [node]
+                while cycle[-1] != neighbor:
+                    cycle.append(parent[cycle[-1]])
+                cycle.reverse()
+                return [int(v) for v in cycle]
+    return None
+
+def articulation_vertices(G):
+    """
+    Vertices of an undirected graph whose removal disconnects it, in
+    increasing order.
+
+    A non-root vertex p is one when some tree child v cannot reach above p:
+    the earliest entry time reachable from v's subtree through one back
+    edge (`reachable`) is not earlier than p's own. A root is one when it
+    has more than one tree child.
+    """
+    indptr, indices = G.indptr, G.indices
+    time_entered = np.full(G.n_vertices, -1, dtype=np.int64)
+    reachable = np.zeros(G.n_vertices, dtype=np.int64)
+    parent = np.full(G.n_vertices, -1, dtype=np.int64)
+    next_edge = indptr[:-1].copy()
+    is_cut = np.zeros(G.n_vertices, dtype=bool)
+
+    time = 0
+    for root in range(G.n_vertices):
+        if time_entered[root] >= 0:
+            continue
+        time_entered[root] = reachable[root] = time
+        time += 1
+        children = 0
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            e = next_edge[node]
+            if e < indptr[node + 1]:
+                next_edge[node] = e + 1
+                neighbor = indices[e]
+                if time_entered[neighbor] < 0:
+                    parent[neighbor] = node
+                    time_entered[neighbor] = reachable[neighbor] = time
+                    time += 1
+                    stack.append(neighbor)
+                    children += node == root
+                elif neighbor != parent[node]:
+                    reachable[node] = min(reachable[node], time_entered[neighbor])
+                continue
+
+            # node is processed: hand its reachable time to its parent
+            stack.pop()
+            up = parent[node]
+            if up >= 0:
+                reachable[up] = min(reachable[up], reachable[node])
+                if up != root and reachable[node] >= time_entered[up]:
+                    is_cut[up] = True
+        if children > 1:
+            is_cut[root] = True
+    return np.nonzero(is_cut)[0]
+
+def main():
+    G = CSRGraph.from_adjacency({0: [1, 3], 1: [2], 2: [], 3: [1, 4], 4: [0]})
+    print(find_cycle(G, 0))
+
+    # (0) -(1) -(4)-(5)-(8)
+    #  |     |       |   |
+    # (2) - (3)     (6)-(7)
+    G = CSRGraph.from_edges([0, 0, 2, 1, 1, 5, 5, 6, 7], [1, 2, 3, 3, 5, 8, 6, 7, 8], directed=False)
+    print(articulation_vertices(G))
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,53 @@ from ipywidgets import *
 from pjdiagram import *
 from step import StepExample
 
-def parent(i): return (i-1)/2
+import operator
+import random
+from array import array
+from functools import partial
+from timeit import Timer
+
+def parent(i): return (i-1)//2
 def left(i): return 2*i+1
 def right(i): return 2*i+2
 
-def percolate_up(heap, startpos, pos):
-    ppos = parent(pos)
-    while pos > startpos and heap[ppos] < heap[pos]:
-        # percolate value up by swapping current position with parent position
-        heap[pos], heap[ppos] = heap[ppos], heap[pos]
-
-        # move up one node
+# The list functions below work in place on the caller's plain list of values
+# (the notebooks and examples depend on that), so they cannot wrap BinaryHeap,
+# which stores slots and cached keys and tracks every slot's position.
+# The two share the hole-shifting sift algorithm but not the code: a common
+# core would need per-step key lookups and position callbacks on the list
+# path. heapsort.sift_down is a separate bottom-up variant over parallel
+# key/value arrays.
+
+def _sift_up(heap, startpos, pos, before):
+    # move the value at `pos` up by shifting parents down into the hole
+    value = heap[pos]
+    while pos > startpos:
+        ppos = (pos-1) >> 1
+        pvalue = heap[ppos]
+        if not before(value, pvalue):
+            break
+        heap[pos] = pvalue
         pos = ppos
-        ppos = parent(pos)
+    heap[pos] = value
+
+def _sift_down(heap, pos, size, before):
+    # move the value at `pos` down by shifting the preferred child up into the hole
+    value = heap[pos]
+    child = 2*pos+1
+    while child < size:
+        right = child+1
+        if right < size and before(heap[right], heap[child]):
+            child = right
+        if not before(heap[child], value):
+            break
+        heap[pos] = heap[child]
+        pos = child
+        child = 2*pos+1
+    heap[pos] = value
+
+def percolate_up(heap, startpos, pos):
+    _sift_up(heap, startpos, pos, operator.gt)
 
 def heap_insert(heap, value):
     # add value to end
@@ -28,23 +62,7 @@ def heap_insert(heap, value):
     percolate_up(heap, 0, len(heap)-1)
 
 def percolate_down(heap, i, size):
-    l = left(i)
-    r = right(i)
-    if l < size and heap[l] > heap[i]:
-        max = l
-    else:
-        max = i
-
-    if r < size and heap[r] > heap[l]:
-        max = r
-
-    # if left or right is greater than current index
-    if max != i:
-        # swap values
-        heap[i], heap[max] = heap[max], heap[i]
-
-        # continue downward
-        percolate_down(heap, max, size)
+    _sift_down(heap, i, size, operator.gt)
 
 def heap_pop(heap):
     # swap root with last value
@@ -54,11 +72,595 @@ def heap_pop(heap):
     result = heap.pop()
 
     # restore heap properties
-    for i in range(len(heap)):
+    if len(heap) > 0:
         percolate_down(heap, 0, len(heap))
 
     return result
 
+# BinaryHeap handles: slot number in the low bits, slot generation above
+SLOT_BITS = 32
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+class PriorityQueue(object):
+    """
+    Interface shared by the priority queues in this module.
+
+    `push` returns a handle identifying the new entry; the handle is what
+    `decrease_key` takes. `merge` moves every entry of `other` into this queue
+    (leaving `other` empty), after which handles from `other` are no longer
+    valid unless the implementation says otherwise.
+    """
+    def push(self, value):
+        raise NotImplementedError
+
+    def pop(self):
+        raise NotImplementedError
+
+    def peek(self):
+        raise NotImplementedError
+
+    def decrease_key(self, handle, value):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+class BinaryHeap(PriorityQueue):
+    """
+    Array-backed binary heap.
+
+    Positions and slots are kept in typed arrays, so the heap itself is a
+    compact buffer of integers. `push` returns a handle for the new entry which
+    can later be passed to `decrease_key`, `increase_key`, `update` or
+    `remove`; each of these is O(log n) because the position of every entry is
+    tracked. Priorities are `key(value)` (or the value itself) and are computed
+    once per entry.
+
+    Entries live in slots that are reused once freed. A handle packs the slot
+    with the slot's generation, bumped whenever the slot is freed, so a handle
+    whose entry was popped, removed or cleared raises KeyError instead of
+    reaching whatever entry took its slot.
+
+    The sift loops are specialized for two children; `DaryHeap`'s general
+    ones are about 1.6x slower when run with d=2.
+    """
+    arity = 2
+
+    def __init__(self, items=(), key=None, order='max'):
+        if order not in ('max', 'min'):
+            raise ValueError("order must be 'max' or 'min', got %r" % (order,))
+
+        self.key = key
+        self.order = order
+        self._before = operator.gt if order == 'max' else operator.lt
+
+        self._heap = array('q')     # position -> slot
+        self._pos = array('q')      # slot -> position (-1 when free)
+        self._gen = array('q')      # slot -> generation
+        self._keys = []             # slot -> priority
+        self._values = []           # slot -> value
+        self._free = []             # slots available for reuse
+
+        self._heapify(items)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, handle):
+        slot = handle & SLOT_MASK
+        return (slot < len(self._pos) and self._pos[slot] >= 0 and
+                self._gen[slot] == handle >> SLOT_BITS)
+
+    def __iter__(self):
+        # values in heap (not sorted) order
+        for slot in self._heap:
+            yield self._values[slot]
+
+    def clear(self):
+        # the slots are kept, with new generations, so old handles stay invalid
+        for slot in self._heap:
+            self._release(slot)
+        del self._heap[:]
+
+    def _priority(self, value):
+        return value if self.key is None else self.key(value)
+
+    def _heapify(self, items):
+        # Floyd's bottom-up construction: O(n) instead of n pushes
+        for value in items:
+            slot = self._acquire(value, self._priority(value))
+            self._pos[slot] = len(self._heap)
+            self._heap.append(slot)
+
+        for i in range((len(self._heap)-2)//self.arity, -1, -1):
+            self._sift_down(i)
+
+    def _acquire(self, value, priority):
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = priority
+            self._values[slot] = value
+        else:
+            slot = len(self._keys)
+            self._keys.append(priority)
+            self._values.append(value)
+            self._pos.append(-1)
+            self._gen.append(0)
+        return slot
+
+    def _release(self, slot):
+        value = self._values[slot]
+        self._keys[slot] = None
+        self._values[slot] = None
+        self._pos[slot] = -1
+        self._gen[slot] += 1
+        self._free.append(slot)
+        return value
+
+    def _slot(self, handle):
+        if handle not in self:
+            raise KeyError("handle %r is not in the heap" % (handle,))
+        return handle & SLOT_MASK
+
+    def _sift_up(self, pos):
+        heap, positions, keys, before = self._heap, self._pos, self._keys, self._before
+        slot = heap[pos]
+        key = keys[slot]
+        while pos > 0:
+            ppos = (pos-1) >> 1
+            pslot = heap[ppos]
+            if not before(key, keys[pslot]):
+                break
+            heap[pos] = pslot
+            positions[pslot] = pos
+            pos = ppos
+        heap[pos] = slot
+        positions[slot] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        heap, positions, keys, before = self._heap, self._pos, self._keys, self._before
+        size = len(heap)
+        slot = heap[pos]
+        key = keys[slot]
+        child = 2*pos+1
+        while child < size:
+            cslot = heap[child]
+            ckey = keys[cslot]
+            right = child+1
+            if right < size:
+                rslot = heap[right]
+                rkey = keys[rslot]
+                if before(rkey, ckey):
+                    child, cslot, ckey = right, rslot, rkey
+            if not before(ckey, key):
+                break
+            heap[pos] = cslot
+            positions[cslot] = pos
+            pos = child
+            child = 2*pos+1
+        heap[pos] = slot
+        positions[slot] = pos
+
+    def _restore(self, pos):
+        # an entry's priority changed: it can only need to move one way
+        if self._sift_up(pos) == pos:
+            self._sift_down(pos)
+
+    def push(self, value):
+        slot = self._acquire(value, self._priority(value))
+        self._heap.append(slot)
+        self._sift_up(len(self._heap)-1)
+        return self._gen[slot] << SLOT_BITS | slot
+
+    def peek(self):
+        if not self._heap:
+            raise IndexError("peek from empty heap")
+        return self._values[self._heap[0]]
+
+    def peek_key(self):
+        if not self._heap:
+            raise IndexError("peek from empty heap")
+        return self._keys[self._heap[0]]
+
+    def pop(self):
+        if not self._heap:
+            raise IndexError("pop from empty heap")
+
+        slot = self._heap[0]
+        last = self._heap.pop()
+        if self._heap:
+            self._heap[0] = last
+            self._sift_down(0)
+        return self._release(slot)
+
+    def replace(self, value):
+        """
+        Pop the top value and push `value` in a single sift.
+        """
+        if not self._heap:
+            raise IndexError("replace on empty heap")
+
+        slot = self._heap[0]
+        result = self._values[slot]
+        self._keys[slot] = self._priority(value)
+        self._values[slot] = value
+        self._sift_down(0)
+        return result
+
+    def remove(self, handle):
+        slot = self._slot(handle)
+        pos = self._pos[slot]
+        last = self._heap.pop()
+        if pos < len(self._heap):
+            self._heap[pos] = last
+            self._pos[last] = pos
+            self._restore(pos)
+        return self._release(slot)
+
+    def merge(self, other):
+        values = list(other)
+        other.clear()
+
+        if len(values) > len(self._heap) // 8:
+            # large merge: append everything and rebuild in O(n + m)
+            self._heapify(values)
+        else:
+            for value in values:
+                self.push(value)
+        return self
+
+    def get(self, handle):
+        return self._values[self._slot(handle)]
+
+    def update(self, handle, value):
+        slot = self._slot(handle)
+        self._keys[slot] = self._priority(value)
+        self._values[slot] = value
+        self._restore(self._pos[slot])
+
+    def decrease_key(self, handle, value):
+        if self._priority(value) > self._keys[self._slot(handle)]:
+            raise ValueError("new key is greater than the current key")
+        self.update(handle, value)
+
+    def increase_key(self, handle, value):
+        if self._priority(value) < self._keys[self._slot(handle)]:
+            raise ValueError("new key is smaller than the current key")
+        self.update(handle, value)
+
+class DaryHeap(BinaryHeap):
+    """
+    Array-backed d-ary heap (4-ary by default).
+
+    A wider node halves the depth of the tree, so sift-ups (push and
+    decrease-key) touch fewer levels and the children compared on a sift-down
+    sit next to each other in memory. Otherwise identical to `BinaryHeap`.
+    """
+    def __init__(self, items=(), key=None, order='max', d=4):
+        if d < 2:
+            raise ValueError("d must be at least 2, got %r" % (d,))
+        self.arity = d
+        super(DaryHeap, self).__init__(items, key=key, order=order)
+
+    def _sift_up(self, pos):
+        heap, positions, keys, before, d = self._heap, self._pos, self._keys, self._before, self.arity
+        slot = heap[pos]
+        key = keys[slot]
+        while pos > 0:
+            ppos = (pos-1) // d
+            pslot = heap[ppos]
+            if not before(key, keys[pslot]):
+                break
+            heap[pos] = pslot
+            positions[pslot] = pos
+            pos = ppos
+        heap[pos] = slot
+        positions[slot] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        heap, positions, keys, before, d = self._heap, self._pos, self._keys, self._before, self.arity
+        size = len(heap)
+        slot = heap[pos]
+        key = keys[slot]
+        first = d*pos+1
+        while first < size:
+            # pick the preferred child among up to d siblings
+            child = first
+            cslot = heap[first]
+            ckey = keys[cslot]
+            for i in range(first+1, min(first+d, size)):
+                islot = heap[i]
+                ikey = keys[islot]
+                if before(ikey, ckey):
+                    child, cslot, ckey = i, islot, ikey
+            if not before(ckey, key):
+                break
+            heap[pos] = cslot
+            positions[cslot] = pos
+            pos = child
+            first = d*pos+1
+        heap[pos] = slot
+        positions[slot] = pos
+
+class _Owner(object):
+    # identifies a heap's current contents; a merged heap's owner forwards to
+    # the heap it was merged into, and clearing a heap starts a new owner
+    __slots__ = ('merged_into',)
+
+    def __init__(self):
+        self.merged_into = None
+
+class PairingNode(object):
+    __slots__ = ('value', 'key', 'child', 'sibling', 'prev', 'owner')
+
+    def __init__(self, value, key, owner):
+        self.value = value
+        self.key = key
+        self.child = None
+        self.sibling = None
+        # parent when this is the first child, otherwise the previous sibling
+        self.prev = None
+        self.owner = owner
+
+class PairingHeap(PriorityQueue):
+    """
+    Pairing heap. Handles are the nodes themselves.
+
+    Push, merge and moving an entry towards the top (`decrease_key` for a
+    min-heap) are O(1); pop is O(log n) amortized. Merging two pairing heaps
+    with the same order and key keeps the handles of both valid; any other
+    merge re-pushes the values, and their old handles raise KeyError.
+    """
+    def __init__(self, items=(), key=None, order='max'):
+        if order not in ('max', 'min'):
+            raise ValueError("order must be 'max' or 'min', got %r" % (order,))
+
+        self.key = key
+        self.order = order
+        self._before = operator.gt if order == 'max' else operator.lt
+        self._root = None
+        self._size = 0
+        self._owner = _Owner()
+
+        for value in items:
+            self.push(value)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, node):
+        if not isinstance(node, PairingNode) or node.owner is None:
+            return False
+        owner = node.owner
+        # forwarding only ever leads from a retired owner to a newer one, so
+        # the chain ends, at the latest, at some heap's current owner
+        while owner is not self._owner and owner.merged_into is not None:
+            owner = owner.merged_into
+        node.owner = owner
+        return owner is self._owner
+
+    def __iter__(self):
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            yield node.value
+            if node.sibling is not None:
+                stack.append(node.sibling)
+            if node.child is not None:
+                stack.append(node.child)
+
+    def clear(self):
+        # O(1): handles of the old nodes stop resolving to this heap
+        self._root = None
+        self._size = 0
+        self._owner = _Owner()
+
+    def _priority(self, value):
+        return value if self.key is None else self.key(value)
+
+    def _check(self, node):
+        if node not in self:
+            raise KeyError("node is not in the heap")
+
+    def _link(self, a, b):
+        # make the root that loses the comparison the first child of the other
+        if self._before(b.key, a.key):
+            a, b = b, a
+        b.sibling = a.child
+        if a.child is not None:
+            a.child.prev = b
+        b.prev = a
+        a.child = b
+        return a
+
+    def _meld(self, node):
+        self._root = node if self._root is None else self._link(self._root, node)
+
+    def _cut(self, node):
+        # detach `node` (and its subtree) from its parent's child list
+        if node.prev.child is node:
+            node.prev.child = node.sibling
+        else:
+            node.prev.sibling = node.sibling
+        if node.sibling is not None:
+            node.sibling.prev = node.prev
+        node.prev = node.sibling = None
+
+    def _merge_pairs(self, first):
+        # two-pass pairing: link neighbours left to right, then fold right to left
+        pairs = []
+        while first is not None:
+            a = first
+            b = a.sibling
+            first = b.sibling if b is not None else None
+            a.prev = a.sibling = None
+            if b is not None:
+                b.prev = b.sibling = None
+                a = self._link(a, b)
+            pairs.append(a)
+
+        root = pairs.pop() if pairs else None
+        while pairs:
+            root = self._link(pairs.pop(), root)
+        return root
+
+    def _detach_children(self, node):
+        children = self._merge_pairs(node.child)
+        node.child = None
+        return children
+
+    def push(self, value):
+        node = PairingNode(value, self._priority(value), self._owner)
+        self._meld(node)
+        self._size += 1
+        return node
+
+    def peek(self):
+        if self._root is None:
+            raise IndexError("peek from empty heap")
+        return self._root.value
+
+    def pop(self):
+        if self._root is None:
+            raise IndexError("pop from empty heap")
+        return self.remove(self._root)
+
+    def remove(self, node):
+        self._check(node)
+        if node is self._root:
+            self._root = self._detach_children(node)
+        else:
+            self._cut(node)
+            children = self._detach_children(node)
+            if children is not None:
+                self._meld(children)
+
+        node.owner = None
+        self._size -= 1
+        return node.value
+
+    def get(self, node):
+        self._check(node)
+        return node.value
+
+    def update(self, node, value):
+        self._check(node)
+        key = self._priority(value)
+        improves = not self._before(node.key, key)
+        node.value = value
+        node.key = key
+
+        if improves:
+            # the subtree below is still heap-ordered, so move it as a whole
+            if node is not self._root:
+                self._cut(node)
+                self._meld(node)
+        else:
+            # children may now belong above the node: split them off first
+            if node is self._root:
+                self._root = self._detach_children(node)
+            else:
+                self._cut(node)
+                children = self._detach_children(node)
+                if children is not None:
+                    self._meld(children)
+            self._meld(node)
+
+    def decrease_key(self, node, value):
+        self._check(node)
+        if self._priority(value) > node.key:
+            raise ValueError("new key is greater than the current key")
+        self.update(node, value)
+
+    def increase_key(self, node, value):
+        self._check(node)
+        if self._priority(value) < node.key:
+            raise ValueError("new key is smaller than the current key")
+        self.update(node, value)
+
+    def merge(self, other):
+        if other is self:
+            return self
+        if isinstance(other, PairingHeap) and other.order == self.order and other.key is self.key:
+            if other._root is not None:
+                self._meld(other._root)
+            self._size += other._size
+            other._owner.merged_into = self._owner
+        else:
+            for value in list(other):
+                self.push(value)
+        other.clear()
+        return self
+
+def top_k(iterable, k, key=None):
+    """
+    The `k` largest items of `iterable`, largest first. Only `k` items are
+    held at any time: a min-heap of the best seen so far whose top is the
+    item to evict next.
+    """
+    if k <= 0:
+        return []
+
+    heap = BinaryHeap(key=key, order='min')
+    items = iter(iterable)
+    for value in items:
+        heap.push(value)
+        if len(heap) == k:
+            break
+    else:
+        return [heap.pop() for i in range(len(heap))][::-1]
+
+    threshold = heap.peek_key()
+    for value in items:
+        priority = value if key is None else key(value)
+        if priority > threshold:
+            heap.replace(value)
+            threshold = heap.peek_key()
+
+    return [heap.pop() for i in range(len(heap))][::-1]
+
+def kway_merge(*iterables, key=None):
+    """
+    Lazily merge already sorted iterables. Holds one item per input; items
+    with equal keys come out in the order of the inputs they were read from.
+    """
+    # entries are [priority, input index, value, iterator]; the index is unique,
+    # so entries never compare values or iterators
+    heap = BinaryHeap(order='min')
+    for index, items in enumerate(map(iter, iterables)):
+        for value in items:
+            heap.push([value if key is None else key(value), index, value, items])
+            break
+
+    while len(heap) > 1:
+        entry = heap.peek()
+        yield entry[2]
+        for value in entry[3]:
+            entry[0] = value if key is None else key(value)
+            entry[2] = value
+            heap.replace(entry)
+            break
+        else:
+            heap.pop()
+
+    if len(heap) > 0:
+        # only one input left: no more comparisons needed
+        entry = heap.pop()
+        yield entry[2]
+        for value in entry[3]:
+            yield value
+
 class InsertItemToHeapExample(StepExample):
     """
     Demonstrates inserting a new item into heap
@@ -216,3 +818,65 @@ def insert_item_to_heap_example(data):
 
 def percolate_down_example(data):
     PercolateDownExample(data)()
+
+def _benchmark_trace(queue_type, trace, n):
+    random.seed(0)
+    values = [random.random() for i in range(n)]
+    queue = queue_type(order='min')
+
+    if trace == 'insert':
+        # mostly pushes with an occasional pop
+        for i, value in enumerate(values):
+            queue.push(value)
+            if i % 10 == 0:
+                queue.pop()
+    elif trace == 'pop':
+        for value in values:
+            queue.push(value)
+        while len(queue) > 0:
+            queue.pop()
+    elif trace == 'decrease_key':
+        # Dijkstra-like: every entry is improved a few times before it is popped
+        handles = [queue.push(value) for value in values]
+        for i in range(4*n):
+            j = random.randrange(n)
+            values[j] *= 0.9
+            queue.decrease_key(handles[j], values[j])
+        while len(queue) > 0:
+            queue.pop()
+
+def benchmark(n=100000):
+    queues = [('binary', BinaryHeap), ('4-ary', DaryHeap), ('pairing', PairingHeap)]
+    print('%-14s' % 'trace' + ''.join('%12s' % name for name, _ in queues))
+    for trace in ['insert', 'pop', 'decrease_key']:
+        times = [Timer(partial(_benchmark_trace, queue_type, trace, n)).timeit(number=1)
+                 for _, queue_type in queues]
+        print('%-14s' % trace + ''.join('%11.3fs' % t for t in times))
+
+def benchmark_streams(n=1000000, k=100, shards=64):
+    random.seed(0)
+    data = [random.random() for i in range(n)]
+    shard_size = n // shards
+    sorted_shards = [sorted(data[i*shard_size:(i+1)*shard_size]) for i in range(shards)]
+
+    def merge_then_consume():
+        for value in kway_merge(*sorted_shards):
+            pass
+
+    def sort_then_consume():
+        for value in sorted([value for shard in sorted_shards for value in shard]):
+            pass
+
+    timings = [
+        ('top_k', partial(top_k, data, k), partial(lambda: sorted(data, reverse=True)[:k])),
+        ('kway_merge', merge_then_consume, sort_then_consume),
+    ]
+    print('%-14s%12s%12s%16s' % ('n=%d' % n, 'heap', 'sort all', 'items/s (heap)'))
+    for name, heap_version, sort_version in timings:
+        heap_time = Timer(heap_version).timeit(number=1)
+        sort_time = Timer(sort_version).timeit(number=1)
+        print('%-14s%11.3fs%11.3fs%16.0f' % (name, heap_time, sort_time, n / heap_time))
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark_streams()
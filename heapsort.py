@@ -6,13 +6,86 @@ from ipywidgets import *
 from pjdiagram import *
 from step import StepExample
 
-from heap import parent, left, right, percolate_down
+from sortutil import is_numeric_array, sort_buffer, sort_keys, write_back
+
+def sift_down(keys, values, lo, pos, size):
+    """
+    Bottom-up (Wegener) sift-down of the max-heap stored in
+    `keys[lo:lo+size]`. Rather than comparing the sifted key against both
+    children at every level, follow the path of larger children all the way
+    to a leaf (one comparison per level) and then climb back up to where the
+    key belongs, which is usually only a level or two. `values`, when not
+    None, is moved in lockstep with `keys`.
+    """
+    key = keys[lo+pos]
+    if values is not None:
+        value = values[lo+pos]
+    start = pos
+
+    child = 2*pos+1
+    while child < size:
+        right = child+1
+        if right < size and keys[lo+child] < keys[lo+right]:
+            child = right
+        keys[lo+pos] = keys[lo+child]
+        if values is not None:
+            values[lo+pos] = values[lo+child]
+        pos = child
+        child = 2*pos+1
+
+    while pos > start:
+        ppos = (pos-1) >> 1
+        if not keys[lo+ppos] < key:
+            break
+        keys[lo+pos] = keys[lo+ppos]
+        if values is not None:
+            values[lo+pos] = values[lo+ppos]
+        pos = ppos
+
+    keys[lo+pos] = key
+    if values is not None:
+        values[lo+pos] = value
+
+def heapify(keys, values, lo, hi):
+    # Floyd: sift down every non-leaf node, starting from the bottom
+    size = hi - lo
+    for i in range(size//2 - 1, -1, -1):
+        sift_down(keys, values, lo, i, size)
+
+def heapsort_range(keys, values, lo, hi):
+    """
+    Sort `keys[lo:hi]` (and `values[lo:hi]` alongside, if given) in place.
+    """
+    heapify(keys, values, lo, hi)
+    for end in range(hi-lo-1, 0, -1):
+        # move the current max behind the heap and shrink it by one
+        keys[lo], keys[lo+end] = keys[lo+end], keys[lo]
+        if values is not None:
+            values[lo], values[lo+end] = values[lo+end], values[lo]
+        sift_down(keys, values, lo, 0, end)
+
+def heapsort(arr, key=None, reverse=False):
+    """
+    In-place heapsort of a list, one-dimensional NumPy array or other mutable
+    sequence (e.g. `array.array`). Numeric NumPy arrays without a key are
+    sorted by NumPy's own heapsort so elements are never boxed.
+    """
+    if key is None and is_numeric_array(arr):
+        arr.sort(kind='heapsort')
+        if reverse:
+            arr[:] = arr[::-1]
+        return
+
+    items = sort_buffer(arr)
+    keys, values = sort_keys(items, key)
+    heapsort_range(keys, values, 0, len(items))
+    if reverse:
+        items.reverse()
+    write_back(arr, items)
 
 def build_heap(lst):
     # start at bottom non-leaf nodes and work up for each node
-    nonleaf_nodes = len(lst)/2
-    for i in range(nonleaf_nodes-1, -1, -1):
-        percolate_down(lst, i, len(lst))
+    heapify(lst, None, 0, len(lst))
 
 class BuildHeapExample(StepExample):
     def __init__(self):
@@ -20,7 +93,7 @@ class BuildHeapExample(StepExample):
 
         self.data = np.random.randint(100, size=15)
         self.tree = list(self.data)
-        self.nonleaf_nodes = len(self.tree)/2
+        self.nonleaf_nodes = len(self.tree)//2
         self.index = self.nonleaf_nodes-1
         self.tree = list(self.data)
         self.prev_trees = []
@@ -48,7 +121,7 @@ class BuildHeapExample(StepExample):
             prev_tree = list(self.tree)
             self.prev_trees.append(list(prev_tree))
             self.prev_indices.append(self.index)
-            percolate_down(self.tree, self.index, len(self.tree))
+            sift_down(self.tree, None, 0, self.index, len(self.tree))
             self.index -= 1
 
         self.drawCanvas(highlight)
@@ -92,6 +165,7 @@ class HeapSortExample(StepExample):
 
     def on_reset(self, b):
         self.tree = np.random.randint(100, size=15)
+        build_heap(self.tree)
         self.prev_trees = []
         self.prev_indices = []
         self.index = len(self.tree)-1
@@ -109,7 +183,7 @@ class HeapSortExample(StepExample):
             self.prev_indices.append(self.index)
 
             self.tree[0], self.tree[self.index] = self.tree[self.index], self.tree[0]
-            percolate_down(self.tree, 0, self.index)
+            sift_down(self.tree, None, 0, 0, self.index)
             self.index -= 1
 
         self.drawCanvas(highlight)
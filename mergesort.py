@@ -5,27 +5,451 @@ from ipywidgets import *
 
 from step import StepExample
 from pjdiagram import *
+from sortutil import is_numeric_array, sort_buffer, write_back
+from heap import BinaryHeap
 
-def merge(left, right):
-    i = j = 0
+import os
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from timeit import Timer
 
-    result = []
-    while i < len(left) or j < len(right):
-        if i >= len(left):
-            result.append(right[j])
+# once one run has won this many comparisons in a row, switch to galloping
+MIN_GALLOP = 7
+
+# runs shorter than the minimum run length (between MIN_MERGE/2 and MIN_MERGE)
+# are extended with binary insertion sort before merging
+MIN_MERGE = 64
+
+def _gallop_right(keys, key, lo, hi):
+    # first index in keys[lo:hi] greater than `key`, probing lo+1, lo+2, lo+4, ...
+    last, offset = lo, 1
+    while lo + offset < hi and not key < keys[lo + offset]:
+        last = lo + offset
+        offset *= 2
+    return bisect_right(keys, key, last, min(lo + offset, hi))
+
+def _gallop_left(keys, key, lo, hi):
+    # first index in keys[lo:hi] not less than `key`
+    last, offset = lo, 1
+    while lo + offset < hi and keys[lo + offset] < key:
+        last = lo + offset
+        offset *= 2
+    return bisect_left(keys, key, last, min(lo + offset, hi))
+
+def _merge(a_keys, a_values, i, a_end, b_keys, b_values, j, b_end, keys, values, d):
+    """
+    Stable merge of the sorted runs `a_keys[i:a_end]` and `b_keys[j:b_end]`
+    into `keys` starting at `d` (with the `*_values` lists, when not None,
+    following their keys). When one run keeps winning, the rest of its
+    winning stretch is found by galloping and copied as a single slice.
+    """
+    a_wins = b_wins = 0
+    while i < a_end and j < b_end:
+        if b_keys[j] < a_keys[i]:
+            keys[d] = b_keys[j]
+            if values is not None:
+                values[d] = b_values[j]
+            d += 1
             j += 1
-        elif j >= len(right):
-            result.append(left[i])
-            i += 1
-        elif left[i] < right[j]:
-            result.append(left[i])
-            i += 1
+            b_wins += 1
+            a_wins = 0
+            if b_wins >= MIN_GALLOP:
+                end = _gallop_left(b_keys, a_keys[i], j, b_end)
+                keys[d:d+end-j] = b_keys[j:end]
+                if values is not None:
+                    values[d:d+end-j] = b_values[j:end]
+                d += end - j
+                j = end
+                b_wins = 0
         else:
-            result.append(right[j])
-            j += 1
+            keys[d] = a_keys[i]
+            if values is not None:
+                values[d] = a_values[i]
+            d += 1
+            i += 1
+            a_wins += 1
+            b_wins = 0
+            if a_wins >= MIN_GALLOP:
+                # equal keys stay with `a` so the merge is stable
+                end = _gallop_right(a_keys, b_keys[j], i, a_end)
+                keys[d:d+end-i] = a_keys[i:end]
+                if values is not None:
+                    values[d:d+end-i] = a_values[i:end]
+                d += end - i
+                i = end
+                a_wins = 0
+
+    keys[d:d+a_end-i] = a_keys[i:a_end]
+    if values is not None:
+        values[d:d+a_end-i] = a_values[i:a_end]
+    d += a_end - i
+    keys[d:d+b_end-j] = b_keys[j:b_end]
+    if values is not None:
+        values[d:d+b_end-j] = b_values[j:b_end]
 
+def merge(left, right):
+    result = [None] * (len(left) + len(right))
+    _merge(left, None, 0, len(left), right, None, 0, len(right), result, None, 0)
     return result
 
+def _min_run(n):
+    # Timsort's choice: n / minrun is a power of two, or slightly less than one
+    r = 0
+    while n >= MIN_MERGE:
+        r |= n & 1
+        n >>= 1
+    return n + r
+
+def _count_run(keys, values, lo, hi):
+    # length of the natural run at `lo`; strictly descending runs are reversed
+    run_hi = lo + 1
+    if run_hi == hi:
+        return 1
+
+    if keys[run_hi] < keys[lo]:
+        while run_hi < hi and keys[run_hi] < keys[run_hi - 1]:
+            run_hi += 1
+        keys[lo:run_hi] = keys[lo:run_hi][::-1]
+        if values is not None:
+            values[lo:run_hi] = values[lo:run_hi][::-1]
+    else:
+        while run_hi < hi and not keys[run_hi] < keys[run_hi - 1]:
+            run_hi += 1
+    return run_hi - lo
+
+def _binary_insertion_sort(keys, values, lo, start, hi):
+    # keys[lo:start] is already sorted; insert keys[start:hi] one at a time
+    for i in range(start, hi):
+        key = keys[i]
+        pos = bisect_right(keys, key, lo, i)
+        if pos != i:
+            keys[pos+1:i+1] = keys[pos:i]
+            keys[pos] = key
+            if values is not None:
+                value = values[i]
+                values[pos+1:i+1] = values[pos:i]
+                values[pos] = value
+
+def merge_sort_lists(keys, values=None):
+    """
+    Stable, bottom-up sort of the list `keys` in place (and of `values`
+    alongside it, if given).
+
+    Natural ascending and strictly descending runs are found first (so
+    already or nearly sorted input is close to O(n)), short runs are extended
+    with binary insertion sort, and then runs are merged pairwise in passes
+    that ping-pong between the input and one preallocated buffer.
+    """
+    n = len(keys)
+    min_run = _min_run(n)
+    runs = [0]
+    lo = 0
+    while lo < n:
+        run = _count_run(keys, values, lo, n)
+        if run < min_run:
+            forced = min(min_run, n - lo)
+            _binary_insertion_sort(keys, values, lo, lo + run, lo + forced)
+            run = forced
+        lo += run
+        runs.append(lo)
+
+    src_keys, src_values = keys, values
+    dst_keys = [None] * n
+    dst_values = [None] * n if values is not None else None
+    while len(runs) > 2:
+        merged = [0]
+        for r in range(0, len(runs) - 1, 2):
+            lo = runs[r]
+            if r + 2 < len(runs):
+                mid, hi = runs[r + 1], runs[r + 2]
+                if src_keys[mid] < src_keys[mid - 1]:
+                    _merge(src_keys, src_values, lo, mid, src_keys, src_values, mid, hi,
+                           dst_keys, dst_values, lo)
+                else:
+                    # the two runs are already in order
+                    dst_keys[lo:hi] = src_keys[lo:hi]
+                    if values is not None:
+                        dst_values[lo:hi] = src_values[lo:hi]
+            else:
+                hi = runs[r + 1]
+                dst_keys[lo:hi] = src_keys[lo:hi]
+                if values is not None:
+                    dst_values[lo:hi] = src_values[lo:hi]
+            merged.append(hi)
+
+        runs = merged
+        src_keys, dst_keys = dst_keys, src_keys
+        src_values, dst_values = dst_values, src_values
+
+    if src_keys is not keys:
+        keys[:] = src_keys
+        if values is not None:
+            values[:] = src_values
+
+def merge_sort(arr, key=None):
+    """
+    Stable in-place merge sort of a list, one-dimensional NumPy array or
+    other mutable sequence. Numeric NumPy arrays without a key use NumPy's
+    stable sort so elements are never boxed.
+    """
+    if key is None and is_numeric_array(arr):
+        arr.sort(kind='stable')
+        return
+
+    items = sort_buffer(arr)
+    if key is None:
+        merge_sort_lists(items)
+    else:
+        merge_sort_lists([key(item) for item in items], items)
+    write_back(arr, items)
+
+def co_rank(d, a, b):
+    """
+    How many of the first `d` items of the stable merge of sorted `a` and `b`
+    come from `a` (the rest come from `b`). Binary search along the merge
+    path's d-th cross diagonal, O(log d).
+    """
+    lo, hi = max(0, d - len(b)), min(d, len(a))
+    while lo < hi:
+        i = (lo + hi) // 2
+        # a[i] still precedes b[d-i-1] (ties go to `a`), so more of `a` is needed
+        if a[i] <= b[d - i - 1]:
+            lo = i + 1
+        else:
+            hi = i
+    return lo
+
+def _attach(name, dtype, n):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray((n,), dtype=dtype, buffer=shm.buf)
+
+def _sort_chunk_task(name, dtype, n, lo, hi):
+    shm, arr = _attach(name, dtype, n)
+    try:
+        arr[lo:hi].sort(kind='stable')
+        del arr
+    finally:
+        shm.close()
+
+def _merge_path_task(src_name, dst_name, dtype, n, lo, mid, hi, d0, d1):
+    # write items d0..d1 of the merge of src[lo:mid] and src[mid:hi] to dst
+    src_shm, src = _attach(src_name, dtype, n)
+    dst_shm, dst = _attach(dst_name, dtype, n)
+    try:
+        a, b = src[lo:mid], src[mid:hi]
+        i0, i1 = co_rank(d0, a, b), co_rank(d1, a, b)
+        j0, j1 = d0 - i0, d1 - i1
+
+        out = dst[lo+d0:lo+d1]
+        out[:i1-i0] = a[i0:i1]
+        out[i1-i0:] = b[j0:j1]
+        # two sorted runs back to back: NumPy's stable sort merges them in one pass
+        out.sort(kind='stable')
+        del a, b, out, src, dst
+    finally:
+        src_shm.close()
+        dst_shm.close()
+
+def parallel_merge_sort(arr, workers=None):
+    """
+    Stable in-place sort of a numeric one-dimensional array using a pool of
+    `workers` processes (None for one per CPU).
+
+    Chunks are sorted in place in a shared memory buffer, then adjacent runs
+    are merged pairwise. Every merge is split into equal output slices with
+    `co_rank` (merge path), so each worker writes a disjoint part of the
+    output buffer directly and the merge is as parallel as the chunk sorts.
+    Anything that is not a numeric array is sorted with `merge_sort`.
+    """
+    if not is_numeric_array(arr):
+        merge_sort(arr)
+        return
+    if workers is None:
+        workers = os.cpu_count()
+
+    n = len(arr)
+    if n < 2:
+        return
+    dtype = arr.dtype.str
+    bounds = np.linspace(0, n, num=min(workers, n) + 1).astype(np.int64).tolist()
+    piece = -(-n // workers)
+
+    src_shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+    dst_shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+    try:
+        src = np.ndarray((n,), dtype=arr.dtype, buffer=src_shm.buf)
+        src[:] = arr
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(_sort_chunk_task, src_shm.name, dtype, n, lo, hi)
+                           for lo, hi in zip(bounds[:-1], bounds[1:])]:
+                future.result()
+
+            src_name, dst_name = src_shm.name, dst_shm.name
+            while len(bounds) > 2:
+                futures = []
+                merged = [0]
+                for r in range(0, len(bounds) - 1, 2):
+                    if r + 2 < len(bounds):
+                        lo, mid, hi = bounds[r], bounds[r + 1], bounds[r + 2]
+                    else:
+                        # odd run out: "merge" it with nothing, i.e. copy it across
+                        lo, mid, hi = bounds[r], bounds[r + 1], bounds[r + 1]
+                    for d0 in range(0, hi - lo, piece):
+                        futures.append(pool.submit(_merge_path_task, src_name, dst_name, dtype, n,
+                                                   lo, mid, hi, d0, min(d0 + piece, hi - lo)))
+                    merged.append(hi)
+                for future in futures:
+                    future.result()
+
+                bounds = merged
+                src_name, dst_name = dst_name, src_name
+
+        result = src if src_name == src_shm.name else np.ndarray((n,), dtype=arr.dtype, buffer=dst_shm.buf)
+        arr[:] = result
+        del src, result
+    finally:
+        for shm in (src_shm, dst_shm):
+            shm.close()
+            shm.unlink()
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+DEFAULT_FAN_IN = 64
+
+def _record_keys(records, key_field):
+    return records if key_field is None else records[key_field]
+
+def _write_sorted_runs(in_path, dtype, key_field, run_records, tmp_dir):
+    # sort RAM-sized chunks of the input into run files
+    data = np.memmap(in_path, dtype=dtype, mode='r')
+    paths = []
+    for start in range(0, len(data), run_records):
+        chunk = np.array(data[start:start+run_records])
+        order = np.argsort(_record_keys(chunk, key_field), kind='stable')
+        path = os.path.join(tmp_dir, 'run-0-%d.bin' % len(paths))
+        chunk[order].tofile(path)
+        paths.append(path)
+    del data
+    return paths
+
+class _RunReader(object):
+    """
+    Sequential, block-at-a-time reader over a sorted run file.
+    """
+    def __init__(self, path, dtype, key_field, block_records):
+        self.data = np.memmap(path, dtype=dtype, mode='r')
+        self.key_field = key_field
+        self.block_records = block_records
+        self.pos = 0
+        self.refill()
+
+    def refill(self):
+        end = min(self.pos + self.block_records, len(self.data))
+        self.buffer = np.array(self.data[self.pos:end])
+        self.keys = _record_keys(self.buffer, self.key_field)
+        self.pos = end
+
+    def consume(self, count):
+        self.buffer = self.buffer[count:]
+        self.keys = self.keys[count:]
+        if len(self.buffer) == 0:
+            self.refill()
+
+def _merge_runs(paths, out_file, dtype, key_field, block_records):
+    """
+    Multi-way merge of sorted run files into `out_file`.
+
+    Each run is read a block at a time. A min-heap over the last key of every
+    buffered block says which run will run dry first; every buffered record
+    up to that key can be written out safely, so each step emits at least a
+    whole block as one vectorized batch rather than a record at a time.
+    """
+    readers = [_RunReader(path, dtype, key_field, block_records) for path in paths]
+    heap = BinaryHeap(order='min')
+    handles = [heap.push((reader.keys[-1], i)) for i, reader in enumerate(readers)]
+
+    while len(heap) > 0:
+        bound, first = heap.peek()
+
+        # runs after `first` hold back keys equal to the bound: records with
+        # that key may still be unread in an earlier run, which must go first
+        counts = []
+        for i, reader in enumerate(readers):
+            if len(reader.buffer) == 0:
+                counts.append(0)
+            elif i == first:
+                counts.append(len(reader.buffer))
+            else:
+                side = 'right' if i < first else 'left'
+                counts.append(int(np.searchsorted(reader.keys, bound, side=side)))
+
+        batch = np.concatenate([reader.buffer[:count]
+                                for reader, count in zip(readers, counts) if count > 0])
+        # runs were concatenated in input order, so a stable sort keeps ties stable
+        order = np.argsort(_record_keys(batch, key_field), kind='stable')
+        out_file.write(batch[order].tobytes())
+
+        for i, (reader, count) in enumerate(zip(readers, counts)):
+            if count == 0:
+                continue
+            reader.consume(count)
+            if len(reader.buffer) == 0:
+                heap.remove(handles[i])
+            else:
+                # a refilled block has a new last key
+                heap.update(handles[i], (reader.keys[-1], i))
+
+def external_sort(in_path, out_path, dtype, key_field=None,
+                  memory_budget=DEFAULT_MEMORY_BUDGET, fan_in=DEFAULT_FAN_IN, tmp_dir=None):
+    """
+    Stable sort of a binary file of fixed-size `dtype` records that may be
+    much larger than memory, ordered by the records themselves or, for
+    structured dtypes (where it is required), by `key_field`.
+
+    Chunks that fit in `memory_budget` bytes are sorted into temporary run
+    files, which are then merged at most `fan_in` at a time until a final
+    merge writes `out_path`.
+    """
+    dtype = np.dtype(dtype)
+    if fan_in < 2:
+        raise ValueError("fan_in must be at least 2, got %r" % (fan_in,))
+    if dtype.names is not None and key_field is None:
+        # whole structured records cannot be compared when merging runs
+        raise ValueError("key_field is required for structured dtype %s" % (dtype,))
+    if os.path.getsize(in_path) % dtype.itemsize != 0:
+        raise ValueError("%s is not a whole number of %d-byte records" % (in_path, dtype.itemsize))
+
+    # a chunk is sorted alongside its int64 argsort and the sorted copy
+    run_records = max(1, memory_budget // (2 * dtype.itemsize + 8))
+    # each step may hold every buffered block twice (the batch and its sorted copy)
+    block_records = max(1, memory_budget // (3 * fan_in * dtype.itemsize))
+
+    if os.path.getsize(in_path) == 0:
+        open(out_path, 'wb').close()
+        return
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        runs = _write_sorted_runs(in_path, dtype, key_field, run_records, tmp)
+
+        level = 1
+        while len(runs) > fan_in:
+            merged = []
+            for group in range(0, len(runs), fan_in):
+                path = os.path.join(tmp, 'run-%d-%d.bin' % (level, len(merged)))
+                with open(path, 'wb', buffering=1 << 20) as run_file:
+                    _merge_runs(runs[group:group+fan_in], run_file, dtype, key_field, block_records)
+                for run in runs[group:group+fan_in]:
+                    os.remove(run)
+                merged.append(path)
+            runs = merged
+            level += 1
+
+        # the input is only read while writing the runs, so out_path may be in_path
+        with open(out_path, 'wb', buffering=1 << 20) as out_file:
+            _merge_runs(runs, out_file, dtype, key_field, block_records)
+
 def mergesort(lst):
     """
     Iterative version of `mergesort` for demo purposes.
@@ -104,3 +528,15 @@ class MergeSortExample(StepExample):
 
 def merge_sort_example(lst):
     MergeSortExample(lst)()
+
+def benchmark(sizes=(10**6, 10**7, 10**8), workers=None):
+    workers = workers or os.cpu_count()
+    print('%12s%12s%12s%10s' % ('n', 'serial', 'parallel', 'speedup'))
+    for n in sizes:
+        data = np.random.randint(-2**62, 2**62, size=n, dtype=np.int64)
+        serial = Timer(lambda: merge_sort(data.copy())).timeit(number=1)
+        parallel = Timer(lambda: parallel_merge_sort(data.copy(), workers)).timeit(number=1)
+        print('%12d%11.3fs%11.3fs%9.2fx' % (n, serial, parallel, serial / parallel))
+
+if __name__ == "__main__":
+    benchmark()
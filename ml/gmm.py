@@ -0,0 +1,201 @@
+import numpy as np
+from kmeans import KMeans, chunk_refs, load_chunk, row_norms
+from timeit import Timer
+
+COVARIANCE_TYPES = ('full', 'diag', 'spherical')
+
+def logsumexp(a, axis=1):
+    # log(sum(exp(a))) without overflow: factor out the largest term
+    top = np.max(a, axis=axis, keepdims=True)
+    top[~np.isfinite(top)] = 0
+    return np.log(np.sum(np.exp(a - top), axis=axis)) + np.squeeze(top, axis=axis)
+
+def precision_cholesky(covariances, covariance_type):
+    """
+    Factor P of every component's precision matrix, with inv(cov) = P P^T.
+    For 'full' this is the transposed inverse of the covariance's Cholesky
+    factor; for 'diag' and 'spherical' it is just 1/sqrt(cov).
+    """
+    if covariance_type != 'full':
+        return 1.0 / np.sqrt(covariances)
+    try:
+        factors = np.linalg.cholesky(covariances)
+    except np.linalg.LinAlgError:
+        raise ValueError("singular covariance matrix: increase reg_covar")
+    return np.transpose(np.linalg.inv(factors), (0, 2, 1))
+
+def log_gaussian(data, means, precisions, covariance_type):
+    # log N(x | mean_j, cov_j) for every point and component, shape (n, k)
+    n, dimensions = data.shape
+    k = means.shape[0]
+    if covariance_type == 'full':
+        mahalanobis = np.empty((n, k))
+        for j in range(k):
+            y = np.dot(data, precisions[j]) - np.dot(means[j], precisions[j])
+            mahalanobis[:, j] = np.einsum('ij,ij->i', y, y)
+        log_det = np.sum(np.log(np.diagonal(precisions, axis1=1, axis2=2)), 1)
+    elif covariance_type == 'diag':
+        scale = precisions**2
+        mahalanobis = np.sum(means**2 * scale, 1) - 2 * np.dot(data, (means * scale).T) + \
+            np.dot(data**2, scale.T)
+        log_det = np.sum(np.log(precisions), 1)
+    else:
+        scale = precisions**2
+        mahalanobis = (np.sum(means**2, 1) - 2 * np.dot(data, means.T) + row_norms(data)[:, None]) * scale
+        log_det = dimensions * np.log(precisions)
+    return -0.5 * (dimensions * np.log(2 * np.pi) + mahalanobis) + log_det
+
+def statistics(data, resp, covariance_type):
+    """Responsibility-weighted counts, sums and second moments."""
+    counts = resp.sum(0)
+    sums = np.dot(resp.T, data)
+    if covariance_type == 'full':
+        squares = np.stack([np.dot((data * resp[:, j, None]).T, data) for j in range(resp.shape[1])])
+    elif covariance_type == 'diag':
+        squares = np.dot(resp.T, data**2)
+    else:
+        squares = np.dot(resp.T, row_norms(data))
+    return counts, sums, squares
+
+class GaussianMixture(object):
+    """
+    Gaussian mixture model fitted by expectation-maximization.
+
+    `covariance_type` is 'full', 'diag' or 'spherical'. The E-step evaluates
+    every component's log density for all points at once through the
+    Cholesky factors of the precisions and normalizes with log-sum-exp. The
+    M-step only needs the responsibility-weighted counts, sums and second
+    moments, so `fit_chunked` can accumulate them over chunks of data larger
+    than memory (the same sources as `KMeans.fit_chunked`). The data is
+    centred on a fixed shift so those moments do not lose precision.
+
+    Responsibilities start from k-means labels: `init` is 'k-means' or an
+    already fitted `KMeans`. Iteration stops once the mean log-likelihood
+    improves by less than `tol`, or after `max_iter` iterations.
+    """
+    def __init__(self, k, covariance_type='full', tol=1e-3, reg_covar=1e-6, max_iter=100,
+                 init='k-means', random_state=None):
+        if covariance_type not in COVARIANCE_TYPES:
+            raise ValueError("unknown covariance type %r" % (covariance_type,))
+        self.k = k
+        self.covariance_type = covariance_type
+        self.tol = tol
+        self.reg_covar = reg_covar
+        self.max_iter = max_iter
+        self.init = init
+        self.random_state = random_state
+
+    def _kmeans(self):
+        if isinstance(self.init, KMeans):
+            return self.init
+        return KMeans(self.k, random_state=self.random_state)
+
+    def _m_step(self, counts, sums, squares):
+        counts = counts + 10 * np.finfo(np.float64).eps
+        means = sums / counts[:, None]
+        dimensions = means.shape[1]
+        if self.covariance_type == 'full':
+            covariances = squares / counts[:, None, None] - means[:, :, None] * means[:, None, :]
+            covariances += self.reg_covar * np.eye(dimensions)
+        elif self.covariance_type == 'diag':
+            covariances = squares / counts[:, None] - means**2 + self.reg_covar
+        else:
+            covariances = (squares / counts - np.sum(means**2, 1)) / dimensions + self.reg_covar
+
+        self.weights_ = counts / counts.sum()
+        self._means = means
+        self.means_ = means + self._shift
+        self.covariances_ = covariances
+        self.precisions_cholesky_ = precision_cholesky(covariances, self.covariance_type)
+
+    def _e_step(self, data):
+        # data is already shifted; returns log responsibilities and log p(x)
+        weighted = log_gaussian(data, self._means, self.precisions_cholesky_, self.covariance_type)
+        weighted += np.log(self.weights_)
+        norm = logsumexp(weighted)
+        return weighted - norm[:, None], norm
+
+    def _accumulate(self, data):
+        log_resp, norm = self._e_step(data)
+        counts, sums, squares = statistics(data, np.exp(log_resp), self.covariance_type)
+        return counts, sums, squares, norm.sum(), data.shape[0]
+
+    def _hard_statistics(self, data, labels):
+        resp = np.zeros((data.shape[0], self.k))
+        resp[np.arange(data.shape[0]), labels] = 1
+        return statistics(data, resp, self.covariance_type)
+
+    def _em(self, initial, accumulate):
+        self._m_step(*initial)
+        self.converged_ = False
+        lower_bound = -np.inf
+        for iteration in range(1, self.max_iter + 1):
+            counts, sums, squares, log_likelihood, n = accumulate()
+            self._m_step(counts, sums, squares)
+            previous, lower_bound = lower_bound, log_likelihood / n
+            if abs(lower_bound - previous) < self.tol:
+                self.converged_ = True
+                break
+        self.n_iter_ = iteration
+        self.lower_bound_ = lower_bound
+        return self
+
+    def fit(self, data):
+        data = np.asarray(data, dtype=np.float64)
+        kmeans = self._kmeans()
+        labels = kmeans.predict(data) if hasattr(kmeans, 'cluster_centers_') else kmeans.fit(data).labels_
+        self._shift = data.mean(0)
+        data = data - self._shift
+        return self._em(self._hard_statistics(data, labels), lambda: self._accumulate(data))
+
+    def fit_chunked(self, source, chunk_size=1 << 16):
+        """
+        EM over a memmap, array or re-iterable of chunks, reading the data
+        once per iteration and keeping only one chunk of responsibilities
+        in memory at a time.
+        """
+        if not isinstance(source, np.ndarray) and iter(source) is source:
+            raise ValueError("chunks are read once per iteration: pass a re-iterable, not an iterator")
+        kmeans = self._kmeans()
+        if not hasattr(kmeans, 'cluster_centers_'):
+            kmeans.fit_chunked(source, chunk_size)
+        self._shift = kmeans.cluster_centers_.mean(0)
+
+        def passes(reduce_chunk):
+            total = None
+            for ref in chunk_refs(source, chunk_size):
+                chunk = load_chunk(ref) - self._shift
+                part = reduce_chunk(chunk)
+                total = part if total is None else [a + b for a, b in zip(total, part)]
+            return total
+
+        initial = passes(lambda chunk: self._hard_statistics(chunk, kmeans.predict(chunk + self._shift)))
+        return self._em(initial, lambda: passes(self._accumulate))
+
+    def predict_proba(self, data):
+        return np.exp(self._e_step(np.asarray(data, dtype=np.float64) - self._shift)[0])
+
+    def predict(self, data):
+        return np.argmax(self._e_step(np.asarray(data, dtype=np.float64) - self._shift)[0], 1)
+
+    def score_samples(self, data):
+        """Log-likelihood of every point under the fitted mixture."""
+        return self._e_step(np.asarray(data, dtype=np.float64) - self._shift)[1]
+
+    def score(self, data):
+        return np.mean(self.score_samples(data))
+
+def benchmark(n=10**5, dimensions=10, k=20):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=5, size=(k, dimensions))
+    data = centers[rng.integers(k, size=n)] + rng.normal(size=(n, dimensions))
+    kmeans = KMeans(k, random_state=0).fit(data)
+
+    print('%-10s%10s%8s%14s' % ('type', 'time', 'iters', 'log-lik'))
+    for covariance_type in COVARIANCE_TYPES:
+        model = GaussianMixture(k, covariance_type, init=kmeans)
+        elapsed = Timer(lambda: model.fit(data)).timeit(number=1)
+        print('%-10s%9.2fs%8d%14.4f' % (covariance_type, elapsed, model.n_iter_, model.lower_bound_))
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,41 +1,534 @@
+import mmap
 import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from neighbors import BallTree, KDTree
+from timeit import Timer
 # from sklearn.metrics.pairwise import euclidean_distances
 
-D = 2
-S = 1000
-K = 3
-max_iterations = 10
+def row_norms(data):
+    # squared norm of every row
+    return np.einsum('ij,ij->i', data, data)
 
-# 1000x2
-data = np.random.rand(S, D)
+def euclidean_distances(data, centroids, data_norms=None):
+    """
+    Squared distances [S x K] from every point to every centroid, computed
+    as ||x||^2 - 2 x.c + ||c||^2 so the bulk of the work is one matrix
+    product. Pass `data_norms` to reuse the point norms across calls.
+    """
+    if data_norms is None:
+        data_norms = row_norms(data)
+    distances = data @ centroids.T
+    distances *= -2
+    distances += data_norms[:, None]
+    distances += row_norms(centroids)[None, :]
+    # cancellation can leave tiny negative values
+    np.maximum(distances, 0, out=distances)
+    return distances
 
-# 3x2
-centroids = np.random.rand(K, D)
+def calc_error(data, centroids, labels):
+    diff = data - centroids[labels]
+    return np.einsum('ij,ij->', diff, diff)
 
-def euclidean_distances(data, centroids):
-    return np.array([np.sum((d - centroids)**2, 1)
-        for d in data])
+def cluster_sums(data, labels, k):
+    # per-cluster coordinate sums and sizes, one bincount per dimension
+    sums = np.empty((k, data.shape[1]))
+    for d in range(data.shape[1]):
+        sums[:, d] = np.bincount(labels, weights=data[:, d], minlength=k)
+    return sums, np.bincount(labels, minlength=k)
 
-def calc_error(data, centroids, labels):
-    total = 0
-    for c in range(centroids.shape[0]):
-        assigned = data[np.where(labels == c)]
-        if assigned.shape[0] > 0:
-            total += np.sum(euclidean_distances(assigned, centroids[c].reshape((1, D))))
-    return total
-
-# # 1000x3
-for iterations in range(max_iterations):
-    # result = np.dot(data, centroids.T)
-    distances = euclidean_distances(data, centroids)
-
-    # distances is: [SxK], per S_i find min K
+def kmeans_plusplus(data, k, rng, data_norms=None):
+    """
+    k-means++ seeding: each new centroid is a data point drawn with
+    probability proportional to its squared distance from the closest
+    centroid chosen so far.
+    """
+    n = data.shape[0]
+    if data_norms is None:
+        data_norms = row_norms(data)
+
+    centroids = np.empty((k, data.shape[1]))
+    centroids[0] = data[rng.integers(n)]
+    closest = euclidean_distances(data, centroids[:1], data_norms)[:, 0]
+    for c in range(1, k):
+        total = closest.sum()
+        if total > 0:
+            index = min(np.searchsorted(np.cumsum(closest), rng.random() * total), n - 1)
+        else:
+            # every point already sits on a centroid
+            index = rng.integers(n)
+        centroids[c] = data[index]
+        np.minimum(closest, euclidean_distances(data, centroids[c:c+1], data_norms)[:, 0], out=closest)
+    return centroids
+
+def init_centroids(data, k, init, rng, data_norms=None):
+    if isinstance(init, str):
+        if data.shape[0] < k:
+            raise ValueError("need at least k=%d points, got %d" % (k, data.shape[0]))
+        if init == 'k-means++':
+            return kmeans_plusplus(data, k, rng, data_norms)
+        if init == 'random':
+            return np.array(data[np.sort(rng.choice(data.shape[0], size=k, replace=False))], dtype=np.float64)
+        raise ValueError("unknown init %r" % (init,))
+
+    centroids = np.array(init, dtype=np.float64)
+    if centroids.shape != (k, data.shape[1]):
+        raise ValueError("init centroids must have shape %r" % ((k, data.shape[1]),))
+    return centroids
+
+def update_centroids(data, labels, centroids):
+    sums, counts = cluster_sums(data, labels, centroids.shape[0])
+    updated = centroids.copy()
+    nonempty = counts > 0
+    updated[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return updated
+
+def pair_distances(data, centroids, rows, cols, block=1 << 20):
+    # distances between data[rows[i]] and centroids[cols[i]], in bounded-size blocks
+    result = np.empty(len(rows))
+    step = max(1, block // max(data.shape[1], 1))
+    for start in range(0, len(rows), step):
+        diff = data[rows[start:start+step]] - centroids[cols[start:start+step]]
+        result[start:start+step] = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    return result
+
+def centroid_separation(centroids):
+    # pairwise centroid distances and half the distance to each one's nearest other centroid
+    between = np.sqrt(euclidean_distances(centroids, centroids))
+    np.fill_diagonal(between, np.inf)
+    return between, 0.5 * between.min(1)
+
+def lloyd(data, centroids, norms, max_iter, tolerance, tree=None):
+    # `tree` (a neighbors.BinaryTree subclass) indexes the centroids for the assignment
+    n, k = data.shape[0], centroids.shape[0]
+    evaluations = []
+    for iteration in range(1, max_iter + 1):
+        if tree is None:
+            labels = np.argmin(euclidean_distances(data, centroids, norms), 1)
+            evaluations.append(n * k)
+        else:
+            index = tree(centroids, leaf_size=TREE_LEAF_SIZE)
+            labels = index.query(data, 1)[1][:, 0]
+            evaluations.append(index.distance_evaluations)
+
+        updated = update_centroids(data, labels, centroids)
+        shift = np.sum((updated - centroids)**2)
+        centroids = updated
+        if shift <= tolerance:
+            break
+    return centroids, iteration, evaluations
+
+def _two_nearest(distances):
+    # labels, nearest and second-nearest distance for every row
+    rows = np.arange(distances.shape[0])
+    nearest = np.argpartition(distances, 1, axis=1)[:, :2]
+    first, second = distances[rows, nearest[:, 0]], distances[rows, nearest[:, 1]]
+    labels = np.where(second < first, nearest[:, 1], nearest[:, 0])
+    return labels, np.minimum(first, second), np.maximum(first, second)
+
+def hamerly(data, centroids, norms, max_iter, tolerance):
+    """
+    Hamerly's k-means: one upper bound (to the assigned centroid) and one
+    lower bound (to every other centroid) per point. A point whose upper
+    bound is below both its lower bound and half the distance from its
+    centroid to the nearest other centroid cannot change cluster, so none of
+    its distances are computed.
+    """
+    n, k = data.shape[0], centroids.shape[0]
+    labels, upper, lower = _two_nearest(np.sqrt(euclidean_distances(data, centroids, norms)))
+    evaluations = [n * k]
+
+    for iteration in range(1, max_iter + 1):
+        if iteration > 1:
+            half_gap = centroid_separation(centroids)[1]
+            bound = np.maximum(half_gap[labels], lower)
+            check = np.flatnonzero(upper > bound)
+
+            # tighten the upper bound first: often that settles the point
+            upper[check] = pair_distances(data, centroids, check, labels[check])
+            computed = len(check)
+            check = check[upper[check] > bound[check]]
+
+            distances = np.sqrt(euclidean_distances(data[check], centroids, norms[check]))
+            labels[check], upper[check], lower[check] = _two_nearest(distances)
+            evaluations.append(computed + len(check) * k)
+
+        updated = update_centroids(data, labels, centroids)
+        moved = np.sqrt(np.sum((updated - centroids)**2, 1))
+        centroids = updated
+        if np.sum(moved**2) <= tolerance:
+            break
+
+        # no centroid came closer than it moved: the largest move (the second
+        # largest, for points assigned to the centroid that moved most) bounds
+        # how much any other centroid can have gained on a point
+        upper += moved[labels]
+        order = np.argsort(moved)[::-1]
+        lower -= np.where(labels == order[0], moved[order[1]], moved[order[0]])
+
+    return centroids, iteration, evaluations
+
+def elkan(data, centroids, norms, max_iter, tolerance):
+    """
+    Elkan's k-means: an upper bound per point and a lower bound for every
+    (point, centroid) pair. On top of Hamerly's test, a centroid is skipped
+    for a point whenever its lower bound, or half its distance to the point's
+    centroid, already exceeds the point's upper bound. Uses O(n k) memory for
+    the bounds in exchange for skipping most distances when k is large.
+    """
+    n, k = data.shape[0], centroids.shape[0]
+    lower = np.sqrt(euclidean_distances(data, centroids, norms))
+    labels = np.argmin(lower, 1)
+    upper = lower[np.arange(n), labels]
+    evaluations = [n * k]
+
+    for iteration in range(1, max_iter + 1):
+        if iteration > 1:
+            between, half_gap = centroid_separation(centroids)
+            check = np.flatnonzero(upper > half_gap[labels])
+
+            def candidates(check):
+                # centroids that could still be closer than the current one
+                bound = np.maximum(lower[check], 0.5 * between[labels[check]])
+                return upper[check, None] > bound
+
+            need = candidates(check)
+            check = check[need.any(1)]
+            upper[check] = pair_distances(data, centroids, check, labels[check])
+            lower[check, labels[check]] = upper[check]
+            computed = len(check)
+
+            need = candidates(check)
+            rows, cols = np.nonzero(need)
+            rows = check[rows]
+            distances = pair_distances(data, centroids, rows, cols)
+            lower[rows, cols] = distances
+            computed += len(rows)
+            evaluations.append(computed)
+
+            if len(rows) > 0:
+                # closest newly computed centroid per point
+                order = np.lexsort((distances, rows))
+                first = order[np.r_[True, rows[order][1:] != rows[order][:-1]]]
+                points, closest, distance = rows[first], cols[first], distances[first]
+                better = distance < upper[points]
+                labels[points[better]] = closest[better]
+                upper[points[better]] = distance[better]
+
+        updated = update_centroids(data, labels, centroids)
+        moved = np.sqrt(np.sum((updated - centroids)**2, 1))
+        centroids = updated
+        if np.sum(moved**2) <= tolerance:
+            break
+
+        upper += moved[labels]
+        lower -= moved[None, :]
+        np.maximum(lower, 0, out=lower)
+
+    return centroids, iteration, evaluations
+
+TREES = {'kd_tree': KDTree, 'ball_tree': BallTree}
+TREE_LEAF_SIZE = 4
+
+ALGORITHMS = {'lloyd': lloyd, 'elkan': elkan, 'hamerly': hamerly}
+
+def load_chunk(ref):
+    # chunks of a file-backed memmap travel as a description, never as data
+    if isinstance(ref, tuple):
+        filename, dtype, shape, offset, start, stop = ref
+        data = np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset)
+        return np.asarray(data[start:stop], dtype=np.float64)
+    return np.asarray(ref, dtype=np.float64)
+
+def partial_sums(ref, centroids):
+    # assignment step for one chunk, reduced to per-cluster sums and counts
+    chunk = load_chunk(ref)
+    distances = euclidean_distances(chunk, centroids)
     labels = np.argmin(distances, 1)
+    sums, counts = cluster_sums(chunk, labels, centroids.shape[0])
+    return sums, counts, distances[np.arange(chunk.shape[0]), labels].sum()
+
+def chunk_refs(source, chunk_size):
+    """
+    What to hand each worker for one pass over `source`: row ranges of a
+    file-backed `numpy.memmap`, slices of any other array, or the chunks of a
+    re-iterable collection of arrays, each split the same way.
+    """
+    if isinstance(source, np.ndarray):
+        backed = isinstance(source, np.memmap) and isinstance(source.base, mmap.mmap) and \
+            source.filename is not None and source.flags.c_contiguous
+        for start in range(0, source.shape[0], chunk_size):
+            stop = min(start + chunk_size, source.shape[0])
+            if backed:
+                yield (source.filename, source.dtype.str, source.shape, source.offset, start, stop)
+            else:
+                yield source[start:stop]
+    else:
+        for chunk in source:
+            if isinstance(chunk, np.ndarray):
+                # memmapped shards go out as file refs of at most chunk_size rows
+                for ref in chunk_refs(chunk, chunk_size):
+                    yield ref
+            else:
+                yield chunk
+
+def sample_rows(source, size, rng, chunk_size):
+    # uniform sample of rows: random sort keys, keeping the smallest `size`
+    if isinstance(source, np.ndarray):
+        rows = np.sort(rng.choice(source.shape[0], size=min(size, source.shape[0]), replace=False))
+        return np.asarray(source[rows], dtype=np.float64)
+
+    sample, keys = None, None
+    for ref in chunk_refs(source, chunk_size):
+        chunk = load_chunk(ref)
+        chunk_keys = rng.random(chunk.shape[0])
+        if sample is None:
+            sample, keys = chunk, chunk_keys
+        else:
+            sample, keys = np.concatenate([sample, chunk]), np.concatenate([keys, chunk_keys])
+        if len(keys) > size:
+            keep = np.argpartition(keys, size)[:size]
+            sample, keys = sample[keep], keys[keep]
+    return sample
+
+class KMeans(object):
+    """
+    k-means clustering.
+
+    `algorithm` is 'lloyd' (every iteration assigns points with one GEMM-based
+    distance computation), or 'hamerly' / 'elkan', which give the same result
+    while using triangle-inequality bounds to skip most distance evaluations
+    once the centroids settle; Hamerly suits low dimensions and moderate k,
+    Elkan large k. Centroids are recomputed with bincount sums, and iteration
+    stops once the centroids move less than `tol` (relative to the mean
+    per-dimension variance of the data) or after `max_iter` iterations.
+    Clusters that lose all their points keep their previous centroid.
+
+    `assign` picks how 'lloyd' finds each point's nearest centroid: 'brute'
+    (the GEMM), or 'kd_tree' / 'ball_tree', which index the centroids in a
+    tree from neighbors.py and pay off for low-dimensional data with
+    thousands of clusters.
+
+    After fitting, `distance_evaluations_` and `distances_avoided_` hold the
+    number of point-centroid distances computed and skipped per iteration.
+    """
+    def __init__(self, k, init='k-means++', tol=1e-4, max_iter=300, random_state=None,
+                 algorithm='lloyd', assign='brute'):
+        if algorithm not in ALGORITHMS:
+            raise ValueError("unknown algorithm %r" % (algorithm,))
+        if assign != 'brute' and (assign not in TREES or algorithm != 'lloyd'):
+            raise ValueError("assign=%r is not supported with algorithm %r" % (assign, algorithm))
+        self.k = k
+        self.init = init
+        self.tol = tol
+        self.max_iter = max_iter
+        self.random_state = random_state
+        self.algorithm = algorithm
+        self.assign = assign
+
+    def _tolerance(self, data):
+        return self.tol * np.mean(np.var(data, axis=0))
+
+    def fit(self, data):
+        data = np.asarray(data, dtype=np.float64)
+        rng = np.random.default_rng(self.random_state)
+        norms = row_norms(data)
+        tolerance = self._tolerance(data)
+
+        centroids = init_centroids(data, self.k, self.init, rng, norms)
+        # the bounds need a second-closest centroid
+        run = ALGORITHMS[self.algorithm] if self.k > 1 else lloyd
+        if self.assign in TREES:
+            run = partial(lloyd, tree=TREES[self.assign])
+        centroids, iteration, evaluations = run(data, centroids, norms, self.max_iter, tolerance)
+
+        distances = euclidean_distances(data, centroids, norms)
+        self.cluster_centers_ = centroids
+        self.labels_ = np.argmin(distances, 1)
+        self.inertia_ = distances[np.arange(data.shape[0]), self.labels_].sum()
+        self.n_iter_ = iteration
+        self.distance_evaluations_ = evaluations
+        self.distances_avoided_ = [data.shape[0] * self.k - count for count in evaluations]
+        return self
+
+    def _chunk_results(self, source, centroids, chunk_size, pool, workers):
+        if pool is None:
+            for ref in chunk_refs(source, chunk_size):
+                yield partial_sums(ref, centroids)
+            return
+        # bound the chunks in flight so memory stays proportional to `workers`
+        pending = deque()
+        for ref in chunk_refs(source, chunk_size):
+            pending.append(pool.submit(partial_sums, ref, centroids))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def fit_chunked(self, source, chunk_size=1 << 16, workers=1, init_size=None):
+        """
+        Lloyd's k-means over data that does not fit in memory: a (typically
+        file-backed) `numpy.memmap` or array, or a re-iterable collection of
+        chunks (e.g. a list of memmaps), which is read once per iteration.
+
+        Each pass assigns chunks on a pool of `workers` processes and reduces
+        them to per-cluster sums and counts, so memory stays bounded by the
+        chunks in flight. Chunks of a file-backed memmap are reopened in the
+        workers rather than pickled. Centroids are seeded from a uniform
+        sample of `init_size` rows. Sets the same attributes as `fit` except
+        `labels_`; `inertia_` is measured against the centroids of the last
+        pass.
+        """
+        if not isinstance(source, np.ndarray) and iter(source) is source:
+            raise ValueError("chunks are read once per iteration: pass a re-iterable, not an iterator")
+        rng = np.random.default_rng(self.random_state)
+        init_size = init_size or max(10 * self.k, 10000)
+
+        sample = sample_rows(source, init_size, rng, chunk_size)
+        centroids = init_centroids(sample, self.k, self.init, rng)
+        tolerance = self._tolerance(sample)
+
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            for iteration in range(1, self.max_iter + 1):
+                sums = np.zeros_like(centroids)
+                counts = np.zeros(self.k, dtype=np.int64)
+                inertia = 0.0
+                for chunk_sums, chunk_counts, chunk_inertia in self._chunk_results(
+                        source, centroids, chunk_size, pool, workers):
+                    sums += chunk_sums
+                    counts += chunk_counts
+                    inertia += chunk_inertia
+                updated = centroids.copy()
+                nonempty = counts > 0
+                updated[nonempty] = sums[nonempty] / counts[nonempty, None]
+                shift = np.sum((updated - centroids)**2)
+                centroids = updated
+                if shift <= tolerance:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.cluster_centers_ = centroids
+        self.inertia_ = inertia
+        self.n_iter_ = iteration
+        return self
+
+    def predict(self, data):
+        return np.argmin(euclidean_distances(np.asarray(data, dtype=np.float64), self.cluster_centers_), 1)
+
+    def fit_predict(self, data):
+        return self.fit(data).labels_
+
+class MiniBatchKMeans(object):
+    """
+    Mini-batch k-means (Sculley, 2010) for data that does not fit in memory.
+
+    Each batch pulls its points' centroids towards them with a per-centroid
+    learning rate of 1/(points seen so far), so only the centroids and their
+    counts are kept between batches. `fit` takes an array (including a
+    `numpy.memmap`, from which random batches are read) or an iterable of
+    chunks; `partial_fit` takes one batch at a time.
+    """
+    def __init__(self, k, batch_size=1024, init='k-means++', tol=1e-4, max_iter=100,
+                 random_state=None):
+        self.k = k
+        self.batch_size = batch_size
+        self.init = init
+        self.tol = tol
+        self.max_iter = max_iter
+        self.random_state = random_state
+        self._rng = np.random.default_rng(random_state)
+        self.cluster_centers_ = None
+
+    def partial_fit(self, batch):
+        batch = np.asarray(batch, dtype=np.float64)
+        norms = row_norms(batch)
+        if self.cluster_centers_ is None:
+            self.cluster_centers_ = init_centroids(batch, self.k, self.init, self._rng, norms)
+            self.counts_ = np.zeros(self.k, dtype=np.int64)
+
+        labels = np.argmin(euclidean_distances(batch, self.cluster_centers_, norms), 1)
+        sums, counts = cluster_sums(batch, labels, self.k)
+        self.counts_ += counts
+
+        # c += (sum - n_batch c) / n_total: the running mean of every point seen
+        seen = counts > 0
+        centroids = self.cluster_centers_
+        previous = centroids[seen].copy()
+        centroids[seen] += (sums[seen] - counts[seen, None] * centroids[seen]) / self.counts_[seen, None]
+        self.last_shift_ = np.sum((centroids[seen] - previous)**2)
+        return self
+
+    def _batches(self, data):
+        if isinstance(data, np.ndarray):
+            for iteration in range(self.max_iter):
+                rows = np.sort(self._rng.choice(data.shape[0], size=min(self.batch_size, data.shape[0]),
+                                                replace=False))
+                yield data[rows]
+        else:
+            for chunk in data:
+                chunk = np.asarray(chunk)
+                for start in range(0, chunk.shape[0], self.batch_size):
+                    yield chunk[start:start + self.batch_size]
+
+    def fit(self, data):
+        tolerance = None
+        for batch in self._batches(data):
+            if self.cluster_centers_ is None and batch.shape[0] < self.k:
+                continue
+            self.partial_fit(batch)
+            if tolerance is None:
+                tolerance = self.tol * np.mean(np.var(batch, axis=0))
+            elif self.last_shift_ <= tolerance:
+                break
+        return self
+
+    def predict(self, data):
+        return np.argmin(euclidean_distances(np.asarray(data, dtype=np.float64), self.cluster_centers_), 1)
+
+def benchmark(n=10**6, dimensions=50, k=100, max_iter=30):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=5, size=(k, dimensions))
+    data = centers[rng.integers(k, size=n)] + rng.normal(size=(n, dimensions))
+    initial = kmeans_plusplus(data, k, rng)
+
+    print('%-10s%10s%8s%16s' % ('algorithm', 'time', 'iters', 'avoided'))
+    for algorithm in ['lloyd', 'hamerly', 'elkan']:
+        model = KMeans(k, init=initial, max_iter=max_iter, algorithm=algorithm)
+        elapsed = Timer(lambda: model.fit(data)).timeit(number=1)
+        avoided = sum(model.distances_avoided_) / float(n * k * model.n_iter_)
+        print('%-10s%9.2fs%8d%15.1f%%' % (algorithm, elapsed, model.n_iter_, 100 * avoided))
+        print('    avoided per iteration:', model.distances_avoided_)
+
+def benchmark_trees(n=10**6, dimensions=2, k=2048, max_iter=5):
+    rng = np.random.default_rng(0)
+    data = rng.random((n, dimensions))
+    initial = kmeans_plusplus(data, k, rng)
+
+    print('%-10s%10s%16s' % ('assign', 'time', 'avoided'))
+    for assign in ['brute', 'kd_tree', 'ball_tree']:
+        model = KMeans(k, init=initial, max_iter=max_iter, tol=0, assign=assign)
+        elapsed = Timer(lambda: model.fit(data)).timeit(number=1)
+        avoided = sum(model.distances_avoided_) / float(n * k * model.n_iter_)
+        print('%-10s%9.2fs%15.1f%%' % (assign, elapsed, 100 * avoided))
+
+def main():
+    D = 2
+    S = 1000
+    K = 3
+
+    # 1000x2
+    data = np.random.rand(S, D)
+
+    model = KMeans(K).fit(data)
+    print(model.inertia_, calc_error(data, model.cluster_centers_, model.labels_))
+    print(model.cluster_centers_)
 
-    print calc_error(data, centroids, labels)
-    print centroids
+    model = MiniBatchKMeans(K, batch_size=100).fit(data)
+    print(model.cluster_centers_)
 
-    for c in range(centroids.shape[0]):
-        assigned = data[np.where(labels == c)]
-        if assigned.shape[0] > 0:
-            centroids[c] = np.mean(assigned)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import numpy as np
+from timeit import Timer
+
+def squared_distances(points, data):
+    # |p|^2 - 2 p.x + |x|^2, one GEMM per block
+    d2 = -2.0 * np.dot(points, data.T)
+    d2 += np.einsum('ij,ij->i', points, points)[:, None]
+    d2 += np.einsum('ij,ij->i', data, data)[None, :]
+    return np.maximum(d2, 0, out=d2)
+
+class BinaryTree(object):
+    """
+    Balanced binary space-partitioning tree over the rows of `data`.
+
+    Nodes live in flat arrays in heap order (children of node i are 2i+1 and
+    2i+2), so every level is full and all leaves sit on the last level. Node i
+    owns `data[index[start[i]:end[i]]]`; each internal node splits its rows at
+    the median of their widest dimension with `np.argpartition`, giving an
+    O(n log n) build. Subclasses supply the per-node bounds.
+
+    Queries are batched: the whole set of query points walks the tree
+    together, and every visited node filters the queries it can still improve
+    with one vectorized bound computation, so the Python work grows with the
+    number of nodes touched rather than the number of points.
+    `distance_evaluations` counts the point-to-point distances computed.
+    """
+    def __init__(self, data, leaf_size=40):
+        super(BinaryTree, self).__init__()
+        self.data = np.asarray(data, dtype=np.float64)
+        n, dimensions = self.data.shape
+        self.leaf_size = leaf_size
+        self.n_levels = 1 + max(0, int(np.log2(max(1, (n - 1) // leaf_size))))
+        n_nodes = 2**self.n_levels - 1
+        self.first_leaf = n_nodes // 2
+        self.index = np.arange(n)
+        self.start = np.zeros(n_nodes, dtype=np.intp)
+        self.end = np.zeros(n_nodes, dtype=np.intp)
+        self.end[0] = n
+        self._allocate(n_nodes, dimensions)
+        self.distance_evaluations = 0
+
+        for node in range(n_nodes):
+            start, end = self.start[node], self.end[node]
+            rows = self.index[start:end]
+            points = self.data[rows]
+            self._set_bounds(node, points)
+            if node >= self.first_leaf:
+                continue
+            mid = (start + end) // 2
+            if end - start > 1:
+                dim = np.argmax(points.max(0) - points.min(0))
+                self.index[start:end] = rows[np.argpartition(points[:, dim], mid - start)]
+            left = 2 * node + 1
+            self.start[left], self.end[left] = start, mid
+            self.start[left + 1], self.end[left + 1] = mid, end
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def _allocate(self, n_nodes, dimensions):
+        raise NotImplementedError
+
+    def _set_bounds(self, node, points):
+        raise NotImplementedError
+
+    def min_distance(self, nodes, points):
+        """Squared lower bound on the distance from each point to its node."""
+        raise NotImplementedError
+
+    def max_distance(self, nodes, points):
+        """Squared upper bound on the distance from each point to its node."""
+        raise NotImplementedError
+
+    def _scan(self, node, queries, points, distances, indices):
+        # brute force over one leaf, merged into the sorted k best of each query
+        rows = self.index[self.start[node]:self.end[node]]
+        d2 = squared_distances(points[queries], self.data[rows])
+        self.distance_evaluations += d2.size
+        k = distances.shape[1]
+        merged = np.concatenate([distances[queries], d2], 1)
+        candidates = np.concatenate([indices[queries], np.broadcast_to(rows, d2.shape)], 1)
+        if merged.shape[1] > k:
+            keep = np.argpartition(merged, k - 1, axis=1)[:, :k]
+            merged = np.take_along_axis(merged, keep, 1)
+            candidates = np.take_along_axis(candidates, keep, 1)
+        order = np.argsort(merged, 1)
+        distances[queries] = np.take_along_axis(merged, order, 1)
+        indices[queries] = np.take_along_axis(candidates, order, 1)
+
+    def _descend(self, points):
+        # leaf each point falls into, following the child with the smaller bound
+        m = points.shape[0]
+        nodes = np.zeros(m, dtype=np.intp)
+        for _ in range(self.n_levels - 1):
+            left = 2 * nodes + 1
+            nodes = left + (self.min_distance(left + 1, points) < self.min_distance(left, points))
+        return nodes
+
+    def query(self, points, k=1):
+        """
+        Distances and indices of the `k` nearest rows of the data for every
+        row of `points`, each sorted nearest first.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        if not 1 <= k <= len(self):
+            raise ValueError("k must be between 1 and the number of points")
+        m = points.shape[0]
+        distances = np.full((m, k), np.inf)
+        indices = np.full((m, k), -1, dtype=np.intp)
+
+        # a first guess from each point's own leaf tightens the bounds early
+        home = self._descend(points)
+        order = np.argsort(home, kind='stable')
+        leaves, starts = np.unique(home[order], return_index=True)
+        for leaf, group in zip(leaves, np.split(order, starts[1:])):
+            self._scan(leaf, group, points, distances, indices)
+
+        stack = [(0, np.arange(m))]
+        while stack:
+            node, queries = stack.pop()
+            bound = self.min_distance(np.full(queries.shape[0], node), points[queries])
+            queries = queries[bound < distances[queries, -1]]
+            if node >= self.first_leaf:
+                queries = queries[home[queries] != node]
+                if queries.size:
+                    self._scan(node, queries, points, distances, indices)
+            elif queries.size:
+                stack.append((2 * node + 2, queries))
+                stack.append((2 * node + 1, queries))
+        return np.sqrt(distances), indices
+
+    def query_radius(self, points, r, return_distance=False):
+        """
+        Indices (and optionally distances) of the rows within distance `r`
+        of each row of `points`, as one array per query point.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        m, r2 = points.shape[0], float(r)**2
+        found_queries, found_rows, found_d2 = [], [], []
+
+        stack = [(0, np.arange(m))]
+        while stack:
+            node, queries = stack.pop()
+            nodes = np.full(queries.shape[0], node)
+            queries = queries[self.min_distance(nodes, points[queries]) <= r2]
+            if not queries.size:
+                continue
+            rows = self.index[self.start[node]:self.end[node]]
+            if node < self.first_leaf:
+                if not return_distance:
+                    # nodes entirely inside the radius need no distances
+                    inside = self.max_distance(nodes[:queries.shape[0]], points[queries]) <= r2
+                    whole = queries[inside]
+                    found_queries.append(np.repeat(whole, rows.shape[0]))
+                    found_rows.append(np.tile(rows, whole.shape[0]))
+                    queries = queries[~inside]
+                if queries.size:
+                    stack.append((2 * node + 2, queries))
+                    stack.append((2 * node + 1, queries))
+                continue
+            d2 = squared_distances(points[queries], self.data[rows])
+            self.distance_evaluations += d2.size
+            hit_query, hit_row = np.nonzero(d2 <= r2)
+            found_queries.append(queries[hit_query])
+            found_rows.append(rows[hit_row])
+            if return_distance:
+                found_d2.append(d2[hit_query, hit_row])
+
+        found_queries = np.concatenate(found_queries) if found_queries else np.zeros(0, dtype=np.intp)
+        order = np.argsort(found_queries, kind='stable')
+        splits = np.cumsum(np.bincount(found_queries, minlength=m))[:-1]
+        rows = np.split(np.concatenate(found_rows)[order] if found_rows else found_queries, splits)
+        if not return_distance:
+            return rows
+        d2 = np.concatenate(found_d2)[order] if found_d2 else np.zeros(0)
+        return rows, np.split(np.sqrt(d2), splits)
+
+class KDTree(BinaryTree):
+    """Binary tree whose nodes are bounded by axis-aligned boxes."""
+    def _allocate(self, n_nodes, dimensions):
+        self.lower = np.zeros((n_nodes, dimensions))
+        self.upper = np.zeros((n_nodes, dimensions))
+
+    def _set_bounds(self, node, points):
+        if points.shape[0]:
+            self.lower[node], self.upper[node] = points.min(0), points.max(0)
+        else:
+            self.lower[node], self.upper[node] = np.inf, -np.inf
+
+    def min_distance(self, nodes, points):
+        gap = np.maximum(self.lower[nodes] - points, 0) + np.maximum(points - self.upper[nodes], 0)
+        return np.einsum('ij,ij->i', gap, gap)
+
+    def max_distance(self, nodes, points):
+        far = np.maximum(np.abs(points - self.lower[nodes]), np.abs(points - self.upper[nodes]))
+        return np.einsum('ij,ij->i', far, far)
+
+class BallTree(BinaryTree):
+    """Binary tree whose nodes are bounded by spheres around their centroids."""
+    def _allocate(self, n_nodes, dimensions):
+        self.centers = np.zeros((n_nodes, dimensions))
+        self.radii = np.full(n_nodes, -np.inf)
+
+    def _set_bounds(self, node, points):
+        if points.shape[0]:
+            self.centers[node] = points.mean(0)
+            self.radii[node] = np.sqrt(np.max(np.sum((points - self.centers[node])**2, 1)))
+
+    def _center_distances(self, nodes, points):
+        offset = points - self.centers[nodes]
+        return np.sqrt(np.einsum('ij,ij->i', offset, offset))
+
+    def min_distance(self, nodes, points):
+        # empty nodes have radius -inf and can never be closer than anything
+        return np.maximum(self._center_distances(nodes, points) - self.radii[nodes], 0)**2
+
+    def max_distance(self, nodes, points):
+        return (self._center_distances(nodes, points) + self.radii[nodes])**2
+
+def benchmark(n=10**5, queries=10**4, k=5):
+    rng = np.random.default_rng(0)
+    print('%-6s%10s%12s%16s' % ('dims', 'tree', 'build', 'query'))
+    for dimensions in [2, 3, 8]:
+        data = rng.random((n, dimensions))
+        points = rng.random((queries, dimensions))
+        for cls in [KDTree, BallTree]:
+            build = Timer(lambda: cls(data)).timeit(number=1)
+            tree = cls(data)
+            query = Timer(lambda: tree.query(points, k)).timeit(number=1)
+            print('%-6d%10s%11.3fs%15.3fs' % (dimensions, cls.__name__, build, query))
+
+if __name__ == "__main__":
+    benchmark()
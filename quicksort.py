@@ -5,8 +5,14 @@ from ipywidgets import *
 
 from step import StepExample
 from pjdiagram import *
+from heapsort import heapsort_range
+from sortutil import is_numeric_array, sort_buffer, sort_keys, write_back
 
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from timeit import Timer
 
 def drawArrowHead(ctx, x, y, x2, y2, arrow_length, arrow_degrees):
     dx = x2 - x
@@ -60,6 +66,231 @@ def partition(lst, start, end):
     lst[start], lst[last] = lst[last], lst[start]
     return last
 
+# ranges this small are finished with insertion sort
+INSERTION_SORT_THRESHOLD = 16
+
+# ranges at least this large use Tukey's ninther instead of median-of-three
+NINTHER_THRESHOLD = 40
+
+def insertion_sort_range(keys, values, lo, hi):
+    for i in range(lo+1, hi):
+        key = keys[i]
+        if values is not None:
+            value = values[i]
+        j = i
+        while j > lo and key < keys[j-1]:
+            keys[j] = keys[j-1]
+            if values is not None:
+                values[j] = values[j-1]
+            j -= 1
+        keys[j] = key
+        if values is not None:
+            values[j] = value
+
+def median_of_three(keys, a, b, c):
+    # index of the median of keys[a], keys[b], keys[c]
+    if keys[a] < keys[b]:
+        if keys[b] < keys[c]: return b
+        return c if keys[a] < keys[c] else a
+    if keys[a] < keys[c]: return a
+    return c if keys[b] < keys[c] else b
+
+def choose_pivot(keys, lo, hi):
+    n = hi - lo
+    mid = lo + n//2
+    if n < NINTHER_THRESHOLD:
+        return median_of_three(keys, lo, mid, hi-1)
+
+    step = n//8
+    return median_of_three(keys,
+        median_of_three(keys, lo, lo+step, lo+2*step),
+        median_of_three(keys, mid-step, mid, mid+step),
+        median_of_three(keys, hi-1-2*step, hi-1-step, hi-1))
+
+def partition3(keys, values, lo, hi, pivot):
+    """
+    Dutch national flag partition of `keys[lo:hi]` around `pivot`. Returns
+    `(lt, gt)` such that `keys[lo:lt] < pivot`, `keys[lt:gt] == pivot` and
+    `keys[gt:hi] > pivot`, so runs of duplicate keys are never revisited.
+    """
+    lt = i = lo
+    gt = hi
+    while i < gt:
+        key = keys[i]
+        if key < pivot:
+            keys[lt], keys[i] = key, keys[lt]
+            if values is not None:
+                values[lt], values[i] = values[i], values[lt]
+            lt += 1
+            i += 1
+        elif pivot < key:
+            gt -= 1
+            keys[gt], keys[i] = key, keys[gt]
+            if values is not None:
+                values[gt], values[i] = values[i], values[gt]
+        else:
+            i += 1
+    return lt, gt
+
+def introsort_range(keys, values, lo, hi):
+    """
+    Sort `keys[lo:hi]` (and `values[lo:hi]` alongside, if given) in place.
+    Quicksort with a depth limit of 2*log2(n): ranges that exceed it are
+    handed to heapsort, which keeps the worst case at O(n log n).
+    """
+    depth_limit = 2 * max(hi - lo, 1).bit_length()
+    stack = [(lo, hi, depth_limit)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        while hi - lo > INSERTION_SORT_THRESHOLD:
+            if depth == 0:
+                heapsort_range(keys, values, lo, hi)
+                break
+            depth -= 1
+
+            pivot = keys[choose_pivot(keys, lo, hi)]
+            lt, gt = partition3(keys, values, lo, hi, pivot)
+
+            # defer the larger side so the stack stays O(log n) deep
+            if lt - lo < hi - gt:
+                stack.append((gt, hi, depth))
+                hi = lt
+            else:
+                stack.append((lo, lt, depth))
+                lo = gt
+        else:
+            insertion_sort_range(keys, values, lo, hi)
+
+def quicksort(lst, key=None, workers=1):
+    """
+    In-place introsort of a list, one-dimensional NumPy array or other
+    mutable sequence. Numeric NumPy arrays without a key use NumPy's own
+    introsort so elements are never boxed, and can be split across `workers`
+    processes (None for one per CPU).
+    """
+    if key is None and is_numeric_array(lst):
+        if workers is None:
+            workers = os.cpu_count()
+        if workers > 1 and len(lst) >= PARALLEL_THRESHOLD:
+            parallel_sort(lst, workers)
+        else:
+            lst.sort(kind='quicksort')
+        return
+
+    items = sort_buffer(lst)
+    keys, values = sort_keys(items, key)
+    introsort_range(keys, values, 0, len(items))
+    write_back(lst, items)
+
+def select_range(keys, values, lo, hi, k):
+    """
+    Rearrange `keys[lo:hi]` so `keys[k]` holds the value it would have if the
+    range were sorted, with nothing larger before it and nothing smaller after
+    it. Expected O(n); like `introsort_range` it falls back to heapsort past
+    2*log2(n) partitions.
+    """
+    depth = 2 * max(hi - lo, 1).bit_length()
+    while hi - lo > INSERTION_SORT_THRESHOLD:
+        if depth == 0:
+            heapsort_range(keys, values, lo, hi)
+            return
+        depth -= 1
+
+        pivot = keys[choose_pivot(keys, lo, hi)]
+        lt, gt = partition3(keys, values, lo, hi, pivot)
+        if k < lt:
+            hi = lt
+        elif k >= gt:
+            lo = gt
+        else:
+            return
+    insertion_sort_range(keys, values, lo, hi)
+
+def _check_rank(n, k):
+    if not -n <= k < n:
+        raise IndexError("rank %d out of range for %d items" % (k, n))
+    return k % n
+
+def nth_element(lst, k, key=None):
+    """
+    Partially sort `lst` in place so that `lst[k]` is the k-th smallest item
+    (by `key`), and return it.
+    """
+    k = _check_rank(len(lst), k)
+    if key is None and is_numeric_array(lst):
+        lst.partition(k)
+        return lst[k]
+
+    items = sort_buffer(lst)
+    keys, values = sort_keys(items, key)
+    select_range(keys, values, 0, len(items), k)
+    write_back(lst, items)
+    return items[k]
+
+def quickselect(lst, k, key=None):
+    """
+    The k-th smallest item of `lst`, leaving `lst` untouched. For example the
+    median is `quickselect(lst, len(lst)//2)`.
+    """
+    k = _check_rank(len(lst), k)
+    if key is None and is_numeric_array(lst):
+        return np.partition(lst, k)[k]
+    return nth_element(list(lst), k, key)
+
+# arrays smaller than this are not worth the cost of starting a process pool
+PARALLEL_THRESHOLD = 1 << 16
+
+# buckets per worker, so uneven buckets still balance across the pool
+BUCKETS_PER_WORKER = 4
+
+def _sort_shared_range(name, dtype, n, start, stop):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        arr = np.ndarray((n,), dtype=dtype, buffer=shm.buf)
+        arr[start:stop].sort(kind='quicksort')
+        del arr
+    finally:
+        shm.close()
+
+def parallel_sort(arr, workers):
+    """
+    Sort a numeric one-dimensional array in place using `workers` processes.
+
+    The top level is a multi-pivot partition: splitters drawn from a sorted
+    random sample divide the values into buckets, which are laid out in order
+    in a shared memory buffer. Each bucket is then an independent subrange
+    that a pool process sorts in place, so the array itself is never pickled.
+    """
+    n = len(arr)
+    buckets = workers * BUCKETS_PER_WORKER
+    sample = np.sort(np.random.choice(arr, size=min(n, buckets * 32), replace=True))
+    step = max(len(sample) // buckets, 1)
+    splitters = np.unique(sample[step::step][:buckets-1])
+
+    bucket = np.searchsorted(splitters, arr, side='right').astype(np.uint16)
+    bounds = np.zeros(len(splitters) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(bucket, minlength=len(splitters) + 1), out=bounds[1:])
+
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    try:
+        shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        # a stable sort of small integers is a counting sort in NumPy
+        shared[:] = arr[np.argsort(bucket, kind='stable')]
+        del bucket
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_sort_shared_range, shm.name, arr.dtype.str, n, start, stop)
+                       for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist())
+                       if stop - start > 1]
+            for future in futures:
+                future.result()
+
+        arr[:] = shared
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
 class PartitionExample(StepExample):
     def __init__(self, lst, pivotIndex):
         super(PartitionExample, self).__init__()
@@ -179,3 +410,15 @@ class QuicksortExample(StepExample):
 
 def quicksort_example(lst):
     return QuicksortExample(lst)()
+
+def benchmark(n=10000000, worker_counts=(1, 2, 4, 8, 16)):
+    data = np.random.rand(n)
+    baseline = None
+    print('%8s%12s%10s' % ('workers', 'time', 'speedup'))
+    for workers in worker_counts:
+        t = min(Timer(lambda: quicksort(data.copy(), workers=workers)).repeat(repeat=3, number=1))
+        baseline = baseline or t
+        print('%8d%11.3fs%9.2fx' % (workers, t, baseline / t))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,42 @@
+import numpy as np
+
+from array import array
+
+def is_numeric_array(seq):
+    # arrays NumPy can sort natively without boxing each element
+    return isinstance(seq, np.ndarray) and seq.ndim == 1 and seq.dtype.kind in 'biuf'
+
+def sort_buffer(seq):
+    """
+    Return a list holding the items of `seq` for a sort to work on. Lists are
+    returned as-is so they are sorted in place; anything else is copied once
+    and should be copied back with `write_back`.
+    """
+    if isinstance(seq, list):
+        return seq
+    if isinstance(seq, np.ndarray):
+        if seq.ndim != 1:
+            raise ValueError("can only sort one-dimensional arrays, got shape %r" % (seq.shape,))
+        return seq.tolist()
+    return list(seq)
+
+def write_back(seq, items):
+    if items is seq:
+        return
+    if isinstance(seq, np.ndarray) and seq.dtype != object:
+        seq[:] = items
+    elif isinstance(seq, array):
+        seq[:] = array(seq.typecode, items)
+    else:
+        for i, item in enumerate(items):
+            seq[i] = item
+
+def sort_keys(items, key):
+    """
+    Returns the `(keys, values)` pair the sort engines work on: with no key
+    function the items are their own keys and `values` is None, otherwise
+    `values` is `items` and is permuted alongside `keys`.
+    """
+    if key is None:
+        return items, None
+    return [key(item) for item in items], items